@@ -1,20 +1,47 @@
+import heapq
+import itertools
 import json
+import logging
 import os
+import queue
+import threading
 import time
 
-from app.db import db_cursor
+from app import counters, metrics
+from app.db import execute_write, read_cursor, submit_write
 from app.notify import send_slack
 
 ALERT_COOLDOWN_DEFAULT = int(os.getenv("ALERT_COOLDOWN_DEFAULT", "60"))
+ALERT_OUTBOX_SIZE = int(os.getenv("ALERT_OUTBOX_SIZE", "1000"))
+ALERT_RETRY_MAX = int(os.getenv("ALERT_RETRY_MAX", "5"))
+ALERT_RETRY_BASE_SEC = float(os.getenv("ALERT_RETRY_BASE_SEC", "2"))
+ALERT_RETRY_MAX_SEC = float(os.getenv("ALERT_RETRY_MAX_SEC", "300"))
+ALERT_DIGEST_SEC = float(os.getenv("ALERT_DIGEST_SEC", "10"))
+ALERT_DIGEST_SAMPLES = int(os.getenv("ALERT_DIGEST_SAMPLES", "10"))
+
+_outbox = queue.Queue(maxsize=ALERT_OUTBOX_SIZE)
+_retries = []
+_retry_seq = itertools.count()
+_last_sent = {}
+_inflight = set()
+_digests = {}
+_rejected_windows = set()
+
+logger = logging.getLogger(__name__)
+_cooldowns_loaded = threading.Event()
+
+
+def _mention(severity):
+    if severity == "CRITICAL":
+        return "@channel "
+    if severity == "WARN":
+        return "@here "
+    return ""
 
 
 def _build_message(policy, context):
     severity = policy["severity"]
-    mention = ""
-    if severity == "CRITICAL":
-        mention = "@channel "
-    elif severity == "WARN":
-        mention = "@here "
+    mention = _mention(severity)
     title = f"[{severity}] {policy['name']}"
     lines = [
         f"*발생 시각*: {context.get('timestamp')}",
@@ -30,88 +57,222 @@ def _build_message(policy, context):
     }
 
 
-def _dedup_key(policy_name, file_path):
+def _build_digest(severity, members):
+    if len(members) == 1:
+        return _build_message(members[0]["policy"], members[0]["context"])
+    counts = {}
+    for member in members:
+        name = member["policy"]["name"]
+        counts[name] = counts.get(name, 0) + 1
+    lines = [f"*{name}*: {count}" for name, count in sorted(counts.items())]
+    lines.append("*대상*:")
+    for member in members[:ALERT_DIGEST_SAMPLES]:
+        context = member["context"]
+        target = context.get("file_path") or context.get("device")
+        lines.append(f"- {member['policy']['name']} {target}: {context.get('summary')}")
+    if len(members) > ALERT_DIGEST_SAMPLES:
+        lines.append(f"- ... +{len(members) - ALERT_DIGEST_SAMPLES}")
+    return {"text": f"{_mention(severity)}[{severity}] {len(members)} alerts\n" + "\n".join(lines)}
+
+
+def _dedup_key(policy_name, file_path, device=None):
+    if file_path is None and device is not None:
+        return f"{policy_name}:device:{device}"
     return f"{policy_name}:{file_path}"
 
 
-def create_alert(policy, context):
-    dedup_key = _dedup_key(policy["name"], context.get("file_path"))
-    summary = context.get("summary")
-    detail = json.dumps(context, ensure_ascii=False)
-    with db_cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO alerts (policy_name, severity, status, dedup_key, summary, detail)
-            VALUES (?, ?, 'PENDING', ?, ?, ?)
-            """,
-            (policy["name"], policy["severity"], dedup_key, summary, detail),
-        )
-    return dedup_key
+def _insert_alert(cur, row):
+    cur.execute(
+        """
+        INSERT INTO alerts (created_ts, policy_name, severity, status, dedup_key, summary, detail)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        row,
+    )
 
 
-def should_send(dedup_key, cooldown_sec):
-    with db_cursor() as cur:
+def load_cooldowns():
+    with read_cursor() as cur:
         cur.execute(
-            """
-            SELECT created_at FROM alerts
-            WHERE dedup_key = ?
-            ORDER BY id DESC LIMIT 1
-            """,
-            (dedup_key,),
+            "SELECT dedup_key, MAX(created_ts) AS created_ts FROM alerts WHERE dedup_key IS NOT NULL GROUP BY dedup_key"
         )
-        row = cur.fetchone()
-        if not row:
-            return True
-        last_time = time.mktime(time.strptime(row["created_at"], "%Y-%m-%d %H:%M:%S"))
-        return time.time() - last_time > cooldown_sec
+        for row in cur.fetchall():
+            if row["created_ts"] is not None:
+                _last_sent[row["dedup_key"]] = max(_last_sent.get(row["dedup_key"], 0), row["created_ts"])
+    _cooldowns_loaded.set()
 
 
-def mark_alert_status(dedup_key, status):
-    with db_cursor() as cur:
-        cur.execute(
-            "UPDATE alerts SET status = ? WHERE dedup_key = ? AND status = 'PENDING'",
-            (status, dedup_key),
-        )
+def _update_alert_statuses(cur, updates):
+    cur.executemany(
+        "UPDATE alerts SET status = ? WHERE dedup_key = ? AND status = 'PENDING'",
+        updates,
+    )
 
 
 def dispatch_alert(policy, context):
-    dedup_key = _dedup_key(policy["name"], context.get("file_path"))
+    try:
+        _outbox.put_nowait((policy, context, time.time(), metrics.start_timer()))
+    except queue.Full:
+        metrics.inc("alerts_dropped_total", policy=policy["name"])
+
+
+def _accept(policy, context, queued_at, started):
+    dedup_key = _dedup_key(policy["name"], context.get("file_path"), context.get("device"))
     cooldown = policy.get("cooldown_sec") or ALERT_COOLDOWN_DEFAULT
-    if not should_send(dedup_key, cooldown):
+    if dedup_key in _inflight or queued_at - _last_sent.get(dedup_key, 0) <= cooldown:
         return
-    create_alert(policy, context)
-    payload = _build_message(policy, context)
-    result = send_slack(payload)
+    _last_sent[dedup_key] = int(queued_at)
+    _inflight.add(dedup_key)
+    submit_write(
+        _insert_alert,
+        (
+            int(queued_at),
+            policy["name"],
+            policy["severity"],
+            "PENDING",
+            dedup_key,
+            context.get("summary"),
+            json.dumps(context, ensure_ascii=False),
+        ),
+    )
+    digest = _digests.get(policy["severity"])
+    if digest is None:
+        digest = _digests[policy["severity"]] = {"opened": queued_at, "members": []}
+    digest["members"].append(
+        {"policy": policy, "context": context, "dedup_key": dedup_key, "started": started}
+    )
+
+
+def _close_digests(now, force=False):
+    ready = []
+    for severity, digest in list(_digests.items()):
+        if force or now - digest["opened"] >= ALERT_DIGEST_SEC:
+            del _digests[severity]
+            members = digest["members"]
+            ready.append(
+                {
+                    "severity": severity,
+                    "members": members,
+                    "payload": _build_digest(severity, members),
+                    "opened": digest["opened"],
+                    "attempts": 0,
+                }
+            )
+    return ready
+
+
+def _retry_delay(result, attempts):
     if result.get("status") == 429:
-        retry_after = int(result.get("headers", {}).get("Retry-After", "1"))
-        time.sleep(retry_after)
-        result = send_slack(payload)
-    status = "SENT" if result.get("ok") else "FAILED"
-    mark_alert_status(dedup_key, status)
+        try:
+            return max(float(result.get("headers", {}).get("Retry-After", "1")), 0)
+        except ValueError:
+            pass
+    return min(ALERT_RETRY_BASE_SEC * 2 ** (attempts - 1), ALERT_RETRY_MAX_SEC)
+
+
+def _deliver(message, updates, now):
+    message["attempts"] += 1
+    result = send_slack(message["payload"])
+    if result.get("ok"):
+        status = "SENT"
+    else:
+        code = result.get("status")
+        retryable = code == 429 or (code or 0) >= 500 or (code is None and result.get("error") != "disabled")
+        if retryable and message["attempts"] < ALERT_RETRY_MAX:
+            metrics.inc("alert_retries_total", severity=message["severity"])
+            heapq.heappush(_retries, (now + _retry_delay(result, message["attempts"]), next(_retry_seq), message))
+            return
+        status = "FAILED"
+    metrics.observe("alert_delivery_seconds", time.time() - message["opened"], severity=message["severity"])
+    metrics.inc("alert_messages_total", severity=message["severity"], status=status)
+    for member in message["members"]:
+        _inflight.discard(member["dedup_key"])
+        updates.append((status, member["dedup_key"]))
+        metrics.observe_since("alert_dispatch_seconds", member["started"], policy=member["policy"]["name"])
+        metrics.inc("alerts_dispatched_total", policy=member["policy"]["name"], status=status)
+
+
+def dispatch_pending(timeout=1.0, force=False):
+    now = time.time()
+    if _retries:
+        timeout = min(timeout, max(_retries[0][0] - now, 0))
+    if _digests:
+        opened = min(digest["opened"] for digest in _digests.values())
+        timeout = min(timeout, max(opened + ALERT_DIGEST_SEC - now, 0))
+    try:
+        _accept(*(_outbox.get(timeout=timeout) if timeout > 0 and not force else _outbox.get_nowait()))
+        while True:
+            _accept(*_outbox.get_nowait())
+    except queue.Empty:
+        pass
+    now = time.time()
+    ready = _close_digests(now, force)
+    while _retries and _retries[0][0] <= now:
+        ready.append(heapq.heappop(_retries)[2])
+    updates = []
+    for message in ready:
+        _deliver(message, updates, time.time())
+    if updates:
+        submit_write(_update_alert_statuses, updates)
+    return len(updates)
+
+
+def run_dispatcher(stop_event):
+    while not _cooldowns_loaded.is_set() and not stop_event.is_set():
+        try:
+            load_cooldowns()
+        except Exception as exc:
+            record_db_error(exc)
+            stop_event.wait(5)
+    while not stop_event.is_set():
+        try:
+            dispatch_pending()
+        except Exception as exc:
+            record_db_error(exc)
+            stop_event.wait(1)
+    dispatch_pending(timeout=0, force=True)
+
+
+def get_outbox_stats():
+    return {
+        "queued": _outbox.qsize(),
+        "digesting": sum(len(digest["members"]) for digest in list(_digests.values())),
+        "retrying": len(_retries),
+        "inflight": len(_inflight),
+    }
 
 
 def list_alerts(limit=50):
-    with db_cursor() as cur:
+    with read_cursor() as cur:
         cur.execute("SELECT * FROM alerts ORDER BY id DESC LIMIT ?", (limit,))
         return [dict(row) for row in cur.fetchall()]
 
 
+def _ack_alert(cur, alert_id):
+    cur.execute("UPDATE alerts SET status='ACK' WHERE id = ?", (alert_id,))
+
+
 def ack_alert(alert_id):
-    with db_cursor() as cur:
-        cur.execute("UPDATE alerts SET status='ACK' WHERE id = ?", (alert_id,))
+    execute_write(_ack_alert, alert_id)
 
 
 def get_policies():
     try:
-        with db_cursor() as cur:
+        with read_cursor() as cur:
             cur.execute("SELECT * FROM alert_policies WHERE enabled = 1")
             return [dict(row) for row in cur.fetchall()]
     except Exception:
         return []
 
 
-def evaluate_policies(status_snapshot):
+def evaluate_policies(status_snapshot, lag_snapshot=None):
     policies = get_policies()
+    windows = [
+        json.loads(policy.get("threshold_json") or "{}").get("window_sec", 60)
+        for policy in policies
+        if policy["name"] == "PARSE_FAIL_RATE"
+    ]
+    counters.set_window(max(windows, default=counters.RATE_WINDOW_SEC))
     for policy in policies:
         name = policy["name"]
         threshold = json.loads(policy.get("threshold_json") or "{}")
@@ -119,47 +280,52 @@ def evaluate_policies(status_snapshot):
         if name == "PARSE_FAIL_RATE":
             _check_parse_fail_rate(policy, threshold, window_sec)
         elif name == "INGEST_STALL":
-            _check_ingest_stall(policy, status_snapshot, window_sec)
+            _check_ingest_stall(policy, status_snapshot, lag_snapshot or {}, window_sec)
         elif name == "FILE_MISSING":
             _check_file_missing(policy, status_snapshot)
 
 
 def _check_parse_fail_rate(policy, threshold, window_sec):
-    with db_cursor() as cur:
-        cur.execute(
-            """
-            SELECT COUNT(*) as total, SUM(CASE WHEN parse_ok = 0 THEN 1 ELSE 0 END) as fail
-            FROM events
-            WHERE strftime('%s', created_at) >= strftime('%s', 'now') - ?
-            """,
-            (window_sec,),
-        )
-        row = cur.fetchone()
-    total = row["total"] or 0
-    fail = row["fail"] or 0
-    if total == 0:
+    if window_sec > counters.WINDOW_MAX_SEC:
+        if policy["name"] not in _rejected_windows:
+            _rejected_windows.add(policy["name"])
+            logger.warning(
+                "%s window_sec %s exceeds ALERT_WINDOW_MAX_SEC=%s; policy not evaluated",
+                policy["name"],
+                window_sec,
+                counters.WINDOW_MAX_SEC,
+            )
         return
-    rate = fail / total
-    if rate >= threshold.get("rate", 0.05):
-        dispatch_alert(
-            policy,
-            {
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "file_path": "all",
-                "device": "all",
-                "grp": "all",
-                "summary": f"parse fail rate {rate:.2%}",
-                "samples": [],
-            },
-        )
+    _rejected_windows.discard(policy["name"])
+    now = time.time()
+    min_events = threshold.get("min_events", 1)
+    for scope in threshold.get("scopes", ("all",)):
+        for key, (total, fail) in counters.window_counts(scope, window_sec, now).items():
+            if total < min_events or total == 0:
+                continue
+            rate = fail / total
+            if rate < threshold.get("rate", 0.05):
+                continue
+            dispatch_alert(
+                policy,
+                {
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "file_path": key if scope != "device" else None,
+                    "device": key if scope != "file" else None,
+                    "grp": "all" if scope == "all" else None,
+                    "summary": f"parse fail rate {rate:.2%} ({fail}/{total})",
+                    "samples": [],
+                },
+            )
 
 
-def _check_ingest_stall(policy, status_snapshot, window_sec):
+def _check_ingest_stall(policy, status_snapshot, lag_snapshot, window_sec):
     now = time.time()
-    for path, status in status_snapshot.items():
-        if status["status"] == "ok":
+    for path, lag in lag_snapshot.items():
+        if not lag or status_snapshot.get(path, {}).get("status") == "missing":
             continue
-        if now - status["updated_at"] > window_sec:
+        idle = now - counters.last_seen("file", path)
+        if idle > window_sec:
             dispatch_alert(
                 policy,
                 {
@@ -167,7 +333,7 @@ def _check_ingest_stall(policy, status_snapshot, window_sec):
                     "file_path": path,
                     "device": None,
                     "grp": None,
-                    "summary": "ingest stalled",
+                    "summary": f"ingest stalled: {lag} bytes behind, no progress for {int(idle)}s",
                     "samples": [],
                 },
             )
@@ -190,8 +356,18 @@ def _check_file_missing(policy, status_snapshot):
 
 
 def record_db_error(error):
-    with db_cursor() as cur:
-        cur.execute(
-            "INSERT INTO alerts (policy_name, severity, status, dedup_key, summary, detail) VALUES (?, ?, 'FAILED', ?, ?, ?)",
-            ("DB_ERROR", "CRITICAL", "DB_ERROR", "DB error", str(error)),
-        )
+    submit_write(
+        _insert_alert,
+        (int(time.time()), "DB_ERROR", "CRITICAL", "FAILED", "DB_ERROR", "DB error", str(error)),
+    )
+
+
+def _collect_metrics():
+    stats = get_outbox_stats()
+    return [
+        (f"alert_outbox_{name}", "gauge", [(f"alert_outbox_{name}", (), value)])
+        for name, value in stats.items()
+    ]
+
+
+metrics.register_collector(_collect_metrics)
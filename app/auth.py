@@ -1,5 +1,9 @@
 import base64
+import hashlib
+import hmac
 import os
+import threading
+import time
 
 from fastapi import HTTPException, Request
 
@@ -9,20 +13,63 @@ ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASS = os.getenv("ADMIN_PASS", "admin")
 VIEWER_USER = os.getenv("VIEWER_USER", "viewer")
 VIEWER_PASS = os.getenv("VIEWER_PASS", "viewer")
+AUTH_CACHE_SEC = float(os.getenv("AUTH_CACHE_SEC", "60"))
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", "1024"))
+
+_cache_lock = threading.Lock()
+_verified = {}
 
 
 def _parse_basic(request: Request):
     auth = request.headers.get("Authorization")
     if not auth or not auth.startswith("Basic "):
         return None, None
-    raw = base64.b64decode(auth.split(" ", 1)[1]).decode("utf-8")
-    username, password = raw.split(":", 1)
+    try:
+        raw = base64.b64decode(auth.split(" ", 1)[1]).decode("utf-8")
+        username, password = raw.split(":", 1)
+    except ValueError:
+        return None, None
     return username, password
 
 
-def require_admin(request: Request):
+def _matches(username, password, expected_user, expected_pass):
+    user_ok = hmac.compare_digest(username.encode("utf-8"), expected_user.encode("utf-8"))
+    pass_ok = hmac.compare_digest(password.encode("utf-8"), expected_pass.encode("utf-8"))
+    return user_ok & pass_ok
+
+
+def _check(username, password):
+    if username is None:
+        return None
+    if _matches(username, password, ADMIN_USER, ADMIN_PASS):
+        return "ADMIN"
+    if _matches(username, password, VIEWER_USER, VIEWER_PASS):
+        return "VIEWER"
+    return None
+
+
+def _verify(request: Request):
+    header = request.headers.get("Authorization") or ""
+    key = hashlib.sha256(header.encode("utf-8")).digest()
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _verified.get(key)
+    if cached is not None and cached[2] > now:
+        return cached[0], cached[1]
     username, password = _parse_basic(request)
-    if username == ADMIN_USER and password == ADMIN_PASS:
+    role = _check(username, password)
+    if role is not None:
+        with _cache_lock:
+            if len(_verified) >= AUTH_CACHE_MAX:
+                for stale in [k for k, entry in _verified.items() if entry[2] <= now] or list(_verified)[:1]:
+                    del _verified[stale]
+            _verified[key] = (username, role, now + AUTH_CACHE_SEC)
+    return username, role
+
+
+def require_admin(request: Request):
+    username, role = _verify(request)
+    if role == "ADMIN":
         record_audit(username, "LOGIN_SUCCESS", "admin")
         return "ADMIN"
     record_audit(username or "unknown", "LOGIN_FAIL", "admin")
@@ -30,12 +77,9 @@ def require_admin(request: Request):
 
 
 def require_viewer(request: Request):
-    username, password = _parse_basic(request)
-    if username == ADMIN_USER and password == ADMIN_PASS:
-        record_audit(username, "LOGIN_SUCCESS", "viewer")
-        return "ADMIN"
-    if username == VIEWER_USER and password == VIEWER_PASS:
+    username, role = _verify(request)
+    if role is not None:
         record_audit(username, "LOGIN_SUCCESS", "viewer")
-        return "VIEWER"
+        return role
     record_audit(username or "unknown", "LOGIN_FAIL", "viewer")
     raise HTTPException(status_code=401, detail="Unauthorized")
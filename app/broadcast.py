@@ -1,38 +1,245 @@
+import asyncio
 import json
-import queue
+import os
 import threading
+import time
+from collections import deque
+from itertools import count, islice
 
-MAX_QUEUE = 2000
+from app import metrics
+
+MAX_QUEUE = int(os.getenv("STREAM_BUFFER_SIZE", "2000"))
+STREAM_HEARTBEAT_SEC = float(os.getenv("STREAM_HEARTBEAT_SEC", "15"))
 
-_event_queue = queue.Queue(maxsize=MAX_QUEUE)
 _lock = threading.Lock()
+_buffer = deque(maxlen=MAX_QUEUE)
+_next_id = 1
+_subscriber_ids = count(1)
+_subscribers = {}
+_stats = {"published": 0, "lagged": 0, "missed": 0}
+_loop_events = {}
+_loop_refs = {}
+_wake_scheduled = set()
+
+FILTER_PARAMS = {"device": "device", "grp": "grp", "file": "file_path", "parse_ok": "parse_ok"}
+
+
+class Subscriber:
+    def __init__(self, cursor, filters=None, projection=None):
+        self.id = next(_subscriber_ids)
+        self.cursor = cursor
+        self.filters = filters or {}
+        self.projection = projection
+        self.connected_at = time.time()
+        self.delivered = 0
+        self.missed = 0
+        self.lagged = False
 
 
 def publish_event(payload):
+    global _next_id
+    with _lock:
+        _buffer.append((_next_id, payload, {}))
+        _next_id += 1
+        _stats["published"] += 1
+        for loop in _loop_events:
+            if loop not in _wake_scheduled:
+                _wake_scheduled.add(loop)
+                try:
+                    loop.call_soon_threadsafe(_wake_loop, loop)
+                except RuntimeError:
+                    _wake_scheduled.discard(loop)
+
+
+def _wake_loop(loop):
+    with _lock:
+        _wake_scheduled.discard(loop)
+        event = _loop_events.get(loop)
+        if event is None:
+            return
+        _loop_events[loop] = asyncio.Event()
+    event.set()
+
+
+def _attach_loop(loop):
+    with _lock:
+        _loop_refs[loop] = _loop_refs.get(loop, 0) + 1
+        if loop not in _loop_events:
+            _loop_events[loop] = asyncio.Event()
+
+
+def _detach_loop(loop):
+    with _lock:
+        _loop_refs[loop] -= 1
+        if not _loop_refs[loop]:
+            del _loop_refs[loop]
+            _loop_events.pop(loop, None)
+
+
+def build_view(params):
+    filters = {}
+    for param, field in FILTER_PARAMS.items():
+        value = params.get(param)
+        if value not in (None, ""):
+            filters[field] = str(value)
+    fields = params.get("fields")
+    if fields:
+        projection = ("include", tuple(sorted({f.strip() for f in fields.split(",") if f.strip()})))
+    elif params.get("raw") in ("0", "false"):
+        projection = ("exclude", ("raw_line",))
+    else:
+        projection = None
+    return filters, projection
+
+
+def _matches(payload, filters):
+    for field, value in filters.items():
+        if str(payload.get(field)) != value:
+            return False
+    return True
+
+
+def _project(payload, projection):
+    if projection is None:
+        return payload
+    mode, fields = projection
+    if mode == "include":
+        return {key: payload[key] for key in fields if key in payload}
+    return {key: value for key, value in payload.items() if key not in fields}
+
+
+def _frame(entry, projection=None):
+    event_id, payload, frames = entry
+    frame = frames.get(projection)
+    if frame is None:
+        data = json.dumps(_project(payload, projection), ensure_ascii=False)
+        frame = f"id: {event_id}\ndata: {data}\n\n"
+        frames[projection] = frame
+    return frame
+
+
+def _parse_event_id(value):
     try:
-        _event_queue.put_nowait(payload)
-    except queue.Full:
-        try:
-            _event_queue.get_nowait()
-        except queue.Empty:
-            pass
-        _event_queue.put_nowait(payload)
-
-
-def iter_events():
-    while True:
-        payload = _event_queue.get()
-        yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
-
-
-def get_snapshot():
-    items = []
-    with _lock:
-        while not _event_queue.empty():
-            try:
-                items.append(_event_queue.get_nowait())
-            except queue.Empty:
-                break
-    for item in items:
-        publish_event(item)
-    return items
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def subscribe(last_event_id=None, filters=None, projection=None):
+    last_event_id = _parse_event_id(last_event_id)
+    with _lock:
+        latest = _next_id - 1
+        cursor = latest if last_event_id is None or last_event_id > latest else last_event_id
+        subscriber = Subscriber(cursor, filters, projection)
+        _subscribers[subscriber.id] = subscriber
+        return subscriber
+
+
+def unsubscribe(subscriber):
+    with _lock:
+        _subscribers.pop(subscriber.id, None)
+
+
+def _take(subscriber):
+    latest = _next_id - 1
+    if subscriber.cursor >= latest:
+        return [], 0
+    oldest = _buffer[0][0] if _buffer else _next_id
+    missed = 0
+    if subscriber.cursor + 1 < oldest:
+        missed = oldest - subscriber.cursor - 1
+        subscriber.cursor = oldest - 1
+        subscriber.missed += missed
+        subscriber.lagged = True
+        _stats["lagged"] += 1
+        _stats["missed"] += missed
+    entries = islice(_buffer, subscriber.cursor + 1 - oldest, None)
+    if subscriber.filters:
+        entries = [entry for entry in entries if _matches(entry[1], subscriber.filters)]
+    else:
+        entries = list(entries)
+    subscriber.cursor = latest
+    subscriber.delivered += len(entries)
+    return entries, missed
+
+
+def _lagged_frame(missed):
+    return f"event: lagged\ndata: {json.dumps({'missed': missed})}\n\n"
+
+
+async def aiter_events(last_event_id=None, is_disconnected=None, filters=None, projection=None):
+    loop = asyncio.get_running_loop()
+    subscriber = subscribe(last_event_id, filters, projection)
+    _attach_loop(loop)
+    try:
+        while True:
+            with _lock:
+                caught_up = subscriber.cursor >= _next_id - 1
+                entries, missed = _take(subscriber)
+                waiter = _loop_events[loop]
+            if not caught_up:
+                frames = [_lagged_frame(missed)] if missed else []
+                frames.extend(_frame(entry, projection) for entry in entries)
+                if frames:
+                    yield "".join(frames)
+            else:
+                try:
+                    await asyncio.wait_for(waiter.wait(), STREAM_HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+            if is_disconnected is not None and await is_disconnected():
+                return
+    finally:
+        unsubscribe(subscriber)
+        _detach_loop(loop)
+
+
+def latest_event_id():
+    with _lock:
+        return _next_id - 1
+
+
+def get_snapshot(filters=None, projection=None):
+    with _lock:
+        entries = list(_buffer)
+        last_event_id = _next_id - 1
+    items = [_project(payload, projection) for _, payload, _ in entries if _matches(payload, filters or {})]
+    return items, last_event_id
+
+
+def get_stream_stats():
+    with _lock:
+        latest = _next_id - 1
+        return {
+            **_stats,
+            "last_event_id": latest,
+            "buffered": len(_buffer),
+            "subscribers": [
+                {
+                    "id": sub.id,
+                    "connected_at": sub.connected_at,
+                    "behind": latest - sub.cursor,
+                    "delivered": sub.delivered,
+                    "missed": sub.missed,
+                    "lagged": sub.lagged,
+                }
+                for sub in _subscribers.values()
+            ],
+        }
+
+
+def _collect_metrics():
+    with _lock:
+        stats = dict(_stats)
+        subscribers = len(_subscribers)
+        buffered = len(_buffer)
+    return [
+        ("stream_published_total", "counter", [("stream_published_total", (), stats["published"])]),
+        ("stream_lagged_total", "counter", [("stream_lagged_total", (), stats["lagged"])]),
+        ("stream_dropped_events_total", "counter", [("stream_dropped_events_total", (), stats["missed"])]),
+        ("stream_subscribers", "gauge", [("stream_subscribers", (), subscribers)]),
+        ("stream_buffered_events", "gauge", [("stream_buffered_events", (), buffered)]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
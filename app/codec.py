@@ -0,0 +1,121 @@
+import json
+import struct
+
+from app.parse import EXACT_FLOAT_INT
+
+PACKED_INT = 0
+PACKED_DECIMAL = 1
+PACKED_FLOAT = 2
+PACKED_WIDTHS = ((1, "b"), (2, "h"), (4, "i"), (8, "q"))
+MAX_DECIMAL_SCALE = 6
+
+
+def _int_width(ints):
+    low = min(ints, default=0)
+    high = max(ints, default=0)
+    for code, (width, fmt) in enumerate(PACKED_WIDTHS):
+        limit = 1 << (width * 8 - 1)
+        if -limit <= low and high < limit:
+            return code, fmt
+    return None, None
+
+
+def _decimal_scale(values):
+    scale = 0
+    for v in values:
+        text = repr(v)
+        if "e" in text or "n" in text or text == "-0.0":
+            return None, None
+        dot = text.find(".")
+        if dot >= 0:
+            scale = max(scale, len(text) - dot - 1)
+    if scale > MAX_DECIMAL_SCALE:
+        return None, None
+    factor = 10**scale
+    scaled = [round(v * factor) for v in values]
+    if any(type(v) is float and s / factor != v for s, v in zip(scaled, values)):
+        return None, None
+    return scale, scaled
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def pack_values(values):
+    count = len(values)
+    bitmap = b""
+    extra = b""
+    if all(type(v) is int for v in values):
+        kind, ints = PACKED_INT, values
+    else:
+        floats = [type(v) is float for v in values]
+        if not all(floats):
+            bitmap = bytes(
+                sum(1 << bit for bit in range(8) if i + bit < count and floats[i + bit]) for i in range(0, count, 8)
+            )
+        scale, ints = _decimal_scale(values)
+        kind = PACKED_FLOAT if scale is None else PACKED_DECIMAL
+        extra = b"" if scale is None else bytes((scale,))
+    if kind == PACKED_FLOAT:
+        if any(type(v) is int and abs(v) > EXACT_FLOAT_INT for v in values):
+            return json.dumps(values)
+        code, fmt = 3, "d"
+        data = values
+    else:
+        code, fmt = _int_width(ints)
+        if code is None:
+            return json.dumps(values)
+        data = ints
+    header = bytes((0x80 | kind << 4 | (8 if bitmap else 0) | code,)) + _varint(count)
+    return header + extra + bitmap + struct.pack(f"<{count}{fmt}", *data)
+
+
+def unpack_values(data):
+    if data is None:
+        return []
+    if isinstance(data, str):
+        return json.loads(data)
+    data = bytes(data)
+    head = data[0]
+    kind = (head >> 4) & 0x07
+    has_bitmap = head & 8
+    count = 0
+    shift = 0
+    pos = 1
+    while True:
+        byte = data[pos]
+        pos += 1
+        count |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    scale = 0
+    if kind == PACKED_DECIMAL:
+        scale = data[pos]
+        pos += 1
+    floats = None
+    if has_bitmap:
+        size = (count + 7) // 8
+        floats = data[pos : pos + size]
+        pos += size
+    fmt = "d" if kind == PACKED_FLOAT else PACKED_WIDTHS[head & 3][1]
+    values = list(struct.unpack_from(f"<{count}{fmt}", data, pos))
+    if kind == PACKED_INT:
+        return values
+    if kind == PACKED_DECIMAL:
+        factor = 10**scale
+        if floats is None:
+            return [v / factor for v in values]
+        return [v / factor if floats[i >> 3] >> (i & 7) & 1 else v // factor for i, v in enumerate(values)]
+    if floats is None:
+        return values
+    return [v if floats[i >> 3] >> (i & 7) & 1 else int(v) for i, v in enumerate(values)]
@@ -0,0 +1,138 @@
+import os
+import time
+from array import array
+from collections import OrderedDict
+
+from app import metrics
+
+WINDOW_MAX_SEC = int(os.getenv("ALERT_WINDOW_MAX_SEC", "600"))
+COUNTER_MAX_KEYS = int(os.getenv("ALERT_COUNTER_MAX_KEYS", "2000"))
+RATE_WINDOW_SEC = 60
+
+_started = time.time()
+_counters = OrderedDict()
+_ring_size = RATE_WINDOW_SEC
+
+
+class RingCounter:
+    __slots__ = ("stamps", "totals", "failed", "last_seen")
+
+    def __init__(self, size=RATE_WINDOW_SEC):
+        self.stamps = array("q", [-1]) * size
+        self.totals = array("q", [0]) * size
+        self.failed = array("q", [0]) * size
+        self.last_seen = None
+
+    def resized(self, size):
+        counter = RingCounter(size)
+        for pos in sorted(range(len(self.stamps)), key=self.stamps.__getitem__):
+            second = self.stamps[pos]
+            if second >= 0:
+                counter.add(self.totals[pos], self.failed[pos], second)
+        counter.last_seen = self.last_seen
+        return counter
+
+    def add(self, total, failed, now):
+        second = int(now)
+        pos = second % len(self.stamps)
+        if self.stamps[pos] != second:
+            self.totals[pos] = 0
+            self.failed[pos] = 0
+            self.stamps[pos] = second
+        self.totals[pos] += total
+        self.failed[pos] += failed
+        self.last_seen = now
+
+    def window(self, seconds, now):
+        size = len(self.stamps)
+        latest = int(now)
+        total = 0
+        failed = 0
+        for second in range(latest - min(int(seconds), size) + 1, latest + 1):
+            pos = second % size
+            if self.stamps[pos] == second:
+                total += self.totals[pos]
+                failed += self.failed[pos]
+        return total, failed
+
+
+def set_window(seconds):
+    global _ring_size
+    _ring_size = min(max(int(seconds), RATE_WINDOW_SEC), WINDOW_MAX_SEC)
+
+
+def _counter(kind, key):
+    counter = _counters.get((kind, key))
+    if counter is None:
+        counter = _counters[(kind, key)] = RingCounter(_ring_size)
+    else:
+        if len(counter.stamps) != _ring_size:
+            counter = _counters[(kind, key)] = counter.resized(_ring_size)
+        _counters.move_to_end((kind, key))
+    return counter
+
+
+def _evict(now):
+    while _counters:
+        key, counter = next(iter(_counters.items()))
+        if len(_counters) <= COUNTER_MAX_KEYS and now - counter.last_seen <= WINDOW_MAX_SEC:
+            break
+        del _counters[key]
+
+
+def record_events(path, payloads, now=None):
+    now = time.time() if now is None else now
+    failed = 0
+    devices = {}
+    for payload in payloads:
+        bad = not payload.get("parse_ok")
+        failed += bad
+        device = payload.get("device")
+        if device is not None:
+            counts = devices.get(device)
+            if counts is None:
+                counts = devices[device] = [0, 0]
+            counts[0] += 1
+            counts[1] += bad
+    _counter("all", "all").add(len(payloads), failed, now)
+    _counter("file", path).add(len(payloads), failed, now)
+    for device, (total, bad) in devices.items():
+        _counter("device", device).add(total, bad, now)
+    _evict(now)
+
+
+def window_counts(kind, seconds, now=None):
+    now = time.time() if now is None else now
+    return {
+        key: counter.window(seconds, now)
+        for (counter_kind, key), counter in list(_counters.items())
+        if counter_kind == kind
+    }
+
+
+def last_seen(kind, key):
+    counter = _counters.get((kind, key))
+    if counter is None or counter.last_seen is None:
+        return _started
+    return counter.last_seen
+
+
+def lines_per_sec(kind, seconds=RATE_WINDOW_SEC, now=None):
+    return {key: round(total / seconds, 2) for key, (total, _) in window_counts(kind, seconds, now).items()}
+
+
+def get_counter_stats():
+    return {
+        "keys": len(_counters),
+        "ring_sec": _ring_size,
+        "lines_per_sec": lines_per_sec("all").get("all", 0.0),
+        "files": lines_per_sec("file"),
+    }
+
+
+def _collect_metrics():
+    samples = [("ingest_lines_per_second", (("file", path),), rate) for path, rate in lines_per_sec("file").items()]
+    return [("ingest_lines_per_second", "gauge", samples)]
+
+
+metrics.register_collector(_collect_metrics)
@@ -1,34 +1,151 @@
+import calendar
 import json
 import os
+import queue
+import re
 import sqlite3
 import threading
 import time
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import Future
 from contextlib import contextmanager
 
+from app import metrics
+from app.codec import pack_values, unpack_values
+
 DB_PATH = os.getenv("DB_PATH", "./data.db")
 RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+RETENTION_PAUSE_SEC = float(os.getenv("RETENTION_PAUSE_SEC", "0.05"))
+
+EVENT_PARTITION_HOURS = int(os.getenv("EVENT_PARTITION_HOURS", "0"))
+EVENT_PARTITION_DIR = os.getenv("EVENT_PARTITION_DIR") or os.path.splitext(DB_PATH)[0] + "_events"
+PARTITION_MAX_ATTACHED = int(os.getenv("PARTITION_MAX_ATTACHED", "8"))
+VALUE_ENCODING = os.getenv("VALUE_ENCODING", "json")
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "4"))
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "10000"))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "256"))
+WRITE_BATCH_SEC = float(os.getenv("WRITE_BATCH_SEC", "0.005"))
+AUDIT_FLUSH_SEC = float(os.getenv("AUDIT_FLUSH_SEC", "5"))
+AUDIT_COLLAPSE_SEC = int(os.getenv("AUDIT_COLLAPSE_SEC", "300"))
+AUDIT_BUFFER_MAX = int(os.getenv("AUDIT_BUFFER_MAX", "500"))
+
+EPOCH_TABLES = ("events", "alerts", "audit_log")
+AUDIT_COLLAPSE_ACTIONS = ("LOGIN_SUCCESS",)
+ADDED_COLUMNS = {
+    "audit_log": (("count", "INTEGER DEFAULT 1"),),
+    "value_profile": (("sample_count", "INTEGER"), ("value_count_sum", "INTEGER")),
+    "value_profile_index": (
+        ("sample_count", "INTEGER"),
+        ("m2", "REAL"),
+        ("negative_count", "INTEGER"),
+        ("sketch", "BLOB"),
+    ),
+}
+PARTITION_NAME_RE = re.compile(r"^events_(\d{10})\.db$")
+
+EVENT_COLUMN_DDL = """
+    created_at TEXT DEFAULT (datetime('now')),
+    created_ts INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+    file_path TEXT,
+    raw_line TEXT,
+    record_type TEXT,
+    parse_ok INTEGER,
+    parse_error TEXT,
+    device TEXT,
+    seq INTEGER,
+    grp INTEGER,
+    values_json TEXT,
+    value_count INTEGER,
+    value_min REAL,
+    value_max REAL,
+    value_avg REAL,
+    has_negative INTEGER,
+    rule_applied_ids_json TEXT,
+    rule_applied_count INTEGER
+"""
+
+EVENT_INDEX_DDL = """
+    DROP INDEX IF EXISTS {schema}.idx_events_device;
+    DROP INDEX IF EXISTS {schema}.idx_events_file_path;
+    CREATE INDEX IF NOT EXISTS {schema}.idx_events_device_id ON events(device, id);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_events_device_grp ON events(device, grp);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_events_device_parse_ok_id ON events(device, parse_ok, id);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_events_file_path_id ON events(file_path, id);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_events_parse_ok ON events(parse_ok);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_events_record_type ON events(record_type);
+    CREATE INDEX IF NOT EXISTS {schema}.idx_events_created_ts ON events(created_ts);
+"""
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+COMMIT_MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
 
 _db_lock = threading.Lock()
+_retention_stats = {}
+_partitions = None
+_expired_partitions = set()
+_attached = {}
+_next_event_id = None
+_read_cond = threading.Condition()
+_read_idle = []
+_read_open = 0
+_read_only = set()
+_pool_stats = {"checkouts": 0, "waits": 0, "wait_sec_total": 0.0, "wait_sec_max": 0.0, "discarded": 0}
+_writer_stats = {"transactions": 0, "wait_sec_total": 0.0, "wait_sec_max": 0.0}
+_write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+_write_thread = None
+_write_thread_lock = threading.Lock()
+_write_ts = None
+_write_stats = {
+    "ops": 0,
+    "failed": 0,
+    "batches": 0,
+    "queue_max": 0,
+    "commit_sec": 0.0,
+    "batch_size": [0] * (len(BATCH_SIZE_BUCKETS) + 1),
+    "commit_ms": [0] * (len(COMMIT_MS_BUCKETS) + 1),
+}
+
 
+_audit_lock = threading.Lock()
+_audit_rows = []
+_audit_collapsed = {}
+_audit_stats = {"oldest": None, "flushed": 0}
 
-def _connect():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+
+def _connect(read_only=False):
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, uri=read_only)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA synchronous=NORMAL")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
+        _read_only.add(conn)
+    else:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
     return conn
 
 
 _conn = _connect()
 
 
+def _record_wait(stats, waited):
+    stats["wait_sec_total"] += waited
+    if waited > stats["wait_sec_max"]:
+        stats["wait_sec_max"] = waited
+
+
 @contextmanager
 def db_cursor():
+    started = time.monotonic()
     with _db_lock:
         global _conn
+        _writer_stats["transactions"] += 1
+        _record_wait(_writer_stats, time.monotonic() - started)
         try:
             _conn.execute("SELECT 1")
         except sqlite3.Error:
+            _attached.pop(_conn, None)
             _conn = _connect()
         cur = _conn.cursor()
         try:
@@ -41,29 +158,248 @@ def db_cursor():
             cur.close()
 
 
+def _checkout_reader():
+    global _read_open
+    started = time.monotonic()
+    with _read_cond:
+        waited = False
+        while not _read_idle and _read_open >= READ_POOL_SIZE:
+            waited = True
+            _read_cond.wait()
+        _pool_stats["checkouts"] += 1
+        if waited:
+            _pool_stats["waits"] += 1
+        _record_wait(_pool_stats, time.monotonic() - started)
+        if _read_idle:
+            return _read_idle.pop()
+        _read_open += 1
+    try:
+        return _connect(read_only=True)
+    except sqlite3.Error:
+        _discard_reader(None)
+        raise
+
+
+def _return_reader(conn):
+    with _read_cond:
+        _read_idle.append(conn)
+        _read_cond.notify()
+
+
+def _discard_reader(conn):
+    global _read_open
+    if conn is not None:
+        _attached.pop(conn, None)
+        _read_only.discard(conn)
+        conn.close()
+    with _read_cond:
+        _read_open -= 1
+        _pool_stats["discarded"] += 1
+        _read_cond.notify()
+
+
+def _sync_attached(conn):
+    attached = _attached.get(conn)
+    if attached:
+        live = set(_list_partitions()) - _expired_partitions
+        for key in [key for key in attached.values() if key not in live]:
+            _detach(conn, key)
+
+
+@contextmanager
+def read_cursor():
+    conn = _checkout_reader()
+    broken = False
+    try:
+        _sync_attached(conn)
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+    except sqlite3.Error:
+        broken = True
+        raise
+    finally:
+        if broken:
+            _discard_reader(conn)
+        else:
+            _return_reader(conn)
+
+
+def get_db_stats():
+    with _read_cond:
+        pool = {
+            "size": READ_POOL_SIZE,
+            "open": _read_open,
+            "idle": len(_read_idle),
+            "in_use": _read_open - len(_read_idle),
+            **_pool_stats,
+        }
+    return {"read_pool": pool, "writer": {**_writer_stats, **get_write_stats()}}
+
+
+def _observe(counts, buckets, value):
+    for pos, bound in enumerate(buckets):
+        if value <= bound:
+            counts[pos] += 1
+            return
+    counts[-1] += 1
+
+
+def _histogram(counts, buckets):
+    labels = [str(bound) for bound in buckets] + ["+Inf"]
+    return dict(zip(labels, counts))
+
+
+def get_write_stats():
+    return {
+        "queue_depth": _write_queue.qsize(),
+        "queue_size": WRITE_QUEUE_SIZE,
+        "queue_max": _write_stats["queue_max"],
+        "ops": _write_stats["ops"],
+        "failed": _write_stats["failed"],
+        "batches": _write_stats["batches"],
+        "batch_size": _histogram(_write_stats["batch_size"], BATCH_SIZE_BUCKETS),
+        "commit_ms": _histogram(_write_stats["commit_ms"], COMMIT_MS_BUCKETS),
+    }
+
+
+def _collect_metrics():
+    with _read_cond:
+        pool = [
+            ("db_read_pool_connections", (("state", "open"),), _read_open),
+            ("db_read_pool_connections", (("state", "in_use"),), _read_open - len(_read_idle)),
+        ]
+        pool_waits = _pool_stats["waits"]
+        pool_wait_sec = _pool_stats["wait_sec_total"]
+    return [
+        ("db_read_pool_connections", "gauge", pool),
+        ("db_read_pool_waits_total", "counter", [("db_read_pool_waits_total", (), pool_waits)]),
+        ("db_read_pool_wait_seconds_total", "counter", [("db_read_pool_wait_seconds_total", (), pool_wait_sec)]),
+        ("db_writer_lock_wait_seconds_total", "counter", [("db_writer_lock_wait_seconds_total", (), _writer_stats["wait_sec_total"])]),
+        ("db_write_queue_depth", "gauge", [("db_write_queue_depth", (), _write_queue.qsize())]),
+        ("db_write_ops_total", "counter", [("db_write_ops_total", (), _write_stats["ops"])]),
+        ("db_write_failed_total", "counter", [("db_write_failed_total", (), _write_stats["failed"])]),
+        (
+            "db_write_batch_size",
+            "histogram",
+            metrics.histogram_samples(
+                "db_write_batch_size", (), BATCH_SIZE_BUCKETS, _write_stats["batch_size"], _write_stats["ops"]
+            ),
+        ),
+        (
+            "db_commit_seconds",
+            "histogram",
+            metrics.histogram_samples(
+                "db_commit_seconds",
+                (),
+                [bound / 1000 for bound in COMMIT_MS_BUCKETS],
+                _write_stats["commit_ms"],
+                _write_stats["commit_sec"],
+            ),
+        ),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def _start_writer():
+    global _write_thread
+    with _write_thread_lock:
+        if _write_thread is None or not _write_thread.is_alive():
+            _write_thread = threading.Thread(target=_writer_loop, name="db-writer", daemon=True)
+            _write_thread.start()
+
+
+def submit_write(op, *args):
+    if _write_thread is None:
+        _start_writer()
+    future = Future()
+    _write_queue.put((op, args, future))
+    depth = _write_queue.qsize()
+    if depth > _write_stats["queue_max"]:
+        _write_stats["queue_max"] = depth
+    return future
+
+
+def execute_write(op, *args):
+    return submit_write(op, *args).result()
+
+
+def flush_writes(timeout=None):
+    if _write_thread is not None:
+        submit_write(lambda cur: None).result(timeout)
+
+
+def _take_batch():
+    batch = [_write_queue.get()]
+    deadline = time.monotonic() + WRITE_BATCH_SEC
+    while len(batch) < WRITE_BATCH_MAX:
+        remaining = deadline - time.monotonic()
+        try:
+            batch.append(_write_queue.get(timeout=remaining) if remaining > 0 else _write_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _prepare_batch(conn):
+    global _write_ts
+    _write_ts = int(time.time())
+    if EVENT_PARTITION_HOURS > 0:
+        _allocate_event_ids(conn, 0)
+        _attach(conn, _partition_key(_write_ts))
+
+
+def _run_batch(batch):
+    results = []
+    started = time.monotonic()
+    with db_cursor() as cur:
+        _prepare_batch(cur.connection)
+        cur.execute("BEGIN")
+        for op, args, future in batch:
+            cur.execute("SAVEPOINT write_op")
+            try:
+                results.append((future, True, op(cur, *args)))
+            except Exception as exc:
+                cur.execute("ROLLBACK TO write_op")
+                results.append((future, False, exc))
+            cur.execute("RELEASE write_op")
+    elapsed = time.monotonic() - started
+    _write_stats["commit_sec"] += elapsed
+    _observe(_write_stats["commit_ms"], COMMIT_MS_BUCKETS, elapsed * 1000)
+    return results
+
+
+def _writer_loop():
+    while True:
+        batch = _take_batch()
+        try:
+            results = _run_batch(batch)
+        except Exception as exc:
+            results = [(future, False, exc) for _, _, future in batch]
+        _write_stats["batches"] += 1
+        _write_stats["ops"] += len(batch)
+        _observe(_write_stats["batch_size"], BATCH_SIZE_BUCKETS, len(batch))
+        for future, ok, value in results:
+            if ok:
+                future.set_result(value)
+            else:
+                _write_stats["failed"] += 1
+                future.set_exception(value)
+        for _ in batch:
+            _write_queue.task_done()
+
+
 def init_db():
     with db_cursor() as cur:
         cur.executescript(
-            """
+            f"""
             CREATE TABLE IF NOT EXISTS events (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                created_at TEXT DEFAULT (datetime('now')),
-                file_path TEXT,
-                raw_line TEXT,
-                record_type TEXT,
-                parse_ok INTEGER,
-                parse_error TEXT,
-                device TEXT,
-                seq INTEGER,
-                grp INTEGER,
-                values_json TEXT,
-                value_count INTEGER,
-                value_min REAL,
-                value_max REAL,
-                value_avg REAL,
-                has_negative INTEGER,
-                rule_applied_ids_json TEXT,
-                rule_applied_count INTEGER
+                {EVENT_COLUMN_DDL}
             );
             CREATE TABLE IF NOT EXISTS file_state (
                 file_path TEXT PRIMARY KEY,
@@ -98,6 +434,8 @@ def init_db():
                 device TEXT,
                 grp INTEGER,
                 typical_value_count INTEGER,
+                sample_count INTEGER,
+                value_count_sum INTEGER,
                 updated_at TEXT,
                 PRIMARY KEY(device, grp)
             );
@@ -113,19 +451,26 @@ def init_db():
                 is_binary INTEGER,
                 is_constant INTEGER,
                 negative_rate REAL,
+                sample_count INTEGER,
+                m2 REAL,
+                negative_count INTEGER,
+                sketch BLOB,
                 updated_at TEXT,
                 PRIMARY KEY(device, grp, idx)
             );
             CREATE TABLE IF NOT EXISTS audit_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 created_at TEXT DEFAULT (datetime('now')),
+                created_ts INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
                 actor TEXT,
                 action TEXT,
-                detail TEXT
+                detail TEXT,
+                count INTEGER DEFAULT 1
             );
             CREATE TABLE IF NOT EXISTS alerts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 created_at TEXT DEFAULT (datetime('now')),
+                created_ts INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
                 policy_name TEXT,
                 severity TEXT,
                 status TEXT,
@@ -144,81 +489,410 @@ def init_db():
             );
             """
         )
-
-
-def insert_event(payload):
-    with db_cursor() as cur:
-        cur.execute(
+        _migrate(cur)
+        cur.executescript(
+            EVENT_INDEX_DDL.format(schema="main")
+            + """
+            CREATE INDEX IF NOT EXISTS idx_alerts_created_ts ON alerts(created_ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_log_created_ts ON audit_log(created_ts);
+            DROP INDEX IF EXISTS idx_events_created_at;
             """
-            INSERT INTO events (
-                file_path, raw_line, record_type, parse_ok, parse_error,
-                device, seq, grp, values_json, value_count, value_min, value_max,
-                value_avg, has_negative, rule_applied_ids_json, rule_applied_count
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                payload.get("file_path"),
-                payload.get("raw_line"),
-                payload.get("record_type"),
-                payload.get("parse_ok"),
-                payload.get("parse_error"),
-                payload.get("device"),
-                payload.get("seq"),
-                payload.get("grp"),
-                json.dumps(payload.get("values", [])),
-                payload.get("value_count"),
-                payload.get("value_min"),
-                payload.get("value_max"),
-                payload.get("value_avg"),
-                payload.get("has_negative"),
-                json.dumps(payload.get("rule_applied_ids", [])),
-                payload.get("rule_applied_count"),
-            ),
         )
 
 
-def update_file_state(file_path, offset, inode):
-    with db_cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO file_state (file_path, offset, inode, updated_at)
-            VALUES (?, ?, ?, datetime('now'))
-            ON CONFLICT(file_path) DO UPDATE SET
-                offset=excluded.offset,
-                inode=excluded.inode,
-                updated_at=datetime('now')
-            """,
-            (file_path, offset, inode),
+def _columns(cur, table):
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row["name"] for row in cur.fetchall()}
+
+
+def _migrate(cur):
+    for table in EPOCH_TABLES:
+        if "created_ts" not in _columns(cur, table):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN created_ts INTEGER")
+            cur.execute(
+                f"UPDATE {table} SET created_ts = CAST(strftime('%s', created_at) AS INTEGER) "
+                "WHERE created_ts IS NULL"
+            )
+    for table, columns in ADDED_COLUMNS.items():
+        existing = _columns(cur, table)
+        for name, kind in columns:
+            if existing and name not in existing:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+
+def _partition_key(ts):
+    span = EVENT_PARTITION_HOURS * 3600
+    return int(ts) - int(ts) % span
+
+
+def _partition_label(key):
+    return time.strftime("%Y%m%d%H", time.gmtime(key))
+
+
+def _partition_path(key):
+    return os.path.join(EVENT_PARTITION_DIR, f"events_{_partition_label(key)}.db")
+
+
+def _list_partitions():
+    global _partitions
+    if _partitions is None:
+        os.makedirs(EVENT_PARTITION_DIR, exist_ok=True)
+        keys = []
+        for name in os.listdir(EVENT_PARTITION_DIR):
+            match = PARTITION_NAME_RE.match(name)
+            if match:
+                keys.append(calendar.timegm(time.strptime(match.group(1), "%Y%m%d%H")))
+        _partitions = sorted(keys)
+    return _partitions
+
+
+def _attach(conn, key):
+    attached = _attached.setdefault(conn, OrderedDict())
+    alias = f"p_{_partition_label(key)}"
+    if alias in attached:
+        attached.move_to_end(alias)
+        return alias
+    while len(attached) >= PARTITION_MAX_ATTACHED:
+        oldest, _ = attached.popitem(last=False)
+        conn.execute(f"DETACH DATABASE {oldest}")
+    created = key not in _list_partitions()
+    if conn in _read_only:
+        if created:
+            return None
+        uri = "file:" + urllib.parse.quote(os.path.abspath(_partition_path(key))) + "?mode=ro"
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (uri,))
+        attached[alias] = key
+        return alias
+    conn.execute(f"ATTACH DATABASE ? AS {alias}", (_partition_path(key),))
+    attached[alias] = key
+    if created:
+        conn.execute(f"PRAGMA {alias}.journal_mode=WAL")
+        conn.executescript(
+            f"CREATE TABLE IF NOT EXISTS {alias}.events (id INTEGER PRIMARY KEY, {EVENT_COLUMN_DDL});"
+            + EVENT_INDEX_DDL.format(schema=alias)
         )
+        _partitions.append(key)
+        _partitions.sort()
+    return alias
 
 
-def get_file_state(file_path):
-    with db_cursor() as cur:
-        cur.execute("SELECT file_path, offset, inode FROM file_state WHERE file_path = ?", (file_path,))
-        row = cur.fetchone()
-        return dict(row) if row else None
+def _detach(conn, key):
+    alias = f"p_{_partition_label(key)}"
+    attached = _attached.get(conn, {})
+    if alias in attached:
+        del attached[alias]
+        conn.execute(f"DETACH DATABASE {alias}")
 
 
-def list_recent_events(limit=200):
-    with db_cursor() as cur:
-        cur.execute("SELECT * FROM events ORDER BY id DESC LIMIT ?", (limit,))
-        return [dict(row) for row in cur.fetchall()]
+def _drop_partition(conn, key):
+    _expired_partitions.add(key)
+    _detach(conn, key)
+    with _read_cond:
+        for reader in _read_idle:
+            _detach(reader, key)
+    path = _partition_path(key)
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+    _partitions.remove(key)
+    _expired_partitions.discard(key)
+    return True
+
+
+def _event_tables(conn, since=None, until=None):
+    if EVENT_PARTITION_HOURS > 0:
+        span = EVENT_PARTITION_HOURS * 3600
+        for key in reversed(list(_list_partitions())):
+            if key in _expired_partitions or until is not None and key >= until:
+                continue
+            if since is not None and key + span <= since:
+                break
+            alias = _attach(conn, key)
+            if alias:
+                yield f"{alias}.events"
+    yield "main.events"
+
+
+def _allocate_event_ids(conn, count):
+    global _next_event_id
+    if _next_event_id is None:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM main.events").fetchone()[0]
+        partitions = _list_partitions()
+        if partitions:
+            alias = _attach(conn, partitions[-1])
+            max_id = max(max_id, conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {alias}.events").fetchone()[0])
+        _next_event_id = max_id + 1
+    first = _next_event_id
+    _next_event_id += count
+    return range(first, first + count)
+
+
+EVENT_INSERT_SQL = """
+    INSERT INTO {table} (
+        id, created_ts, file_path, raw_line, record_type, parse_ok, parse_error,
+        device, seq, grp, values_json, value_count, value_min, value_max,
+        value_avg, has_negative, rule_applied_ids_json, rule_applied_count
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+FILE_STATE_UPSERT_SQL = """
+    INSERT INTO file_state (file_path, offset, inode, updated_at)
+    VALUES (?, ?, ?, datetime('now'))
+    ON CONFLICT(file_path) DO UPDATE SET
+        offset=excluded.offset,
+        inode=excluded.inode,
+        updated_at=datetime('now')
+"""
+
+
+def encode_values(values):
+    if VALUE_ENCODING == "packed":
+        return pack_values(values)
+    return json.dumps(values)
 
 
-def prune_old_records():
+def decode_event(row):
+    if "values_json" in row:
+        row["values"] = unpack_values(row.pop("values_json"))
+    if "rule_applied_ids_json" in row:
+        row["rule_applied_ids"] = unpack_values(row.pop("rule_applied_ids_json"))
+    return row
+
+
+def _event_row(payload, created_ts):
+    return (
+        created_ts,
+        payload.get("file_path"),
+        payload.get("raw_line"),
+        payload.get("record_type"),
+        payload.get("parse_ok"),
+        payload.get("parse_error"),
+        payload.get("device"),
+        payload.get("seq"),
+        payload.get("grp"),
+        encode_values(payload.get("values", [])),
+        payload.get("value_count"),
+        payload.get("value_min"),
+        payload.get("value_max"),
+        payload.get("value_avg"),
+        payload.get("has_negative"),
+        encode_values(payload.get("rule_applied_ids", [])),
+        payload.get("rule_applied_count"),
+    )
+
+
+def _write_events(cur, payloads):
+    created_ts = _write_ts
+    if EVENT_PARTITION_HOURS > 0:
+        table = f"{_attach(cur.connection, _partition_key(created_ts))}.events"
+        ids = _allocate_event_ids(cur.connection, len(payloads))
+    else:
+        table = "main.events"
+        ids = [None] * len(payloads)
+    cur.executemany(
+        EVENT_INSERT_SQL.format(table=table),
+        [(event_id, *_event_row(payload, created_ts)) for event_id, payload in zip(ids, payloads)],
+    )
+
+
+def _insert_events(cur, payloads, file_path, offset, inode):
+    if payloads:
+        _write_events(cur, payloads)
+    cur.execute(FILE_STATE_UPSERT_SQL, (file_path, offset, inode))
+
+
+def insert_events(payloads, file_path, offset, inode):
+    execute_write(_insert_events, payloads, file_path, offset, inode)
+
+
+def list_file_states():
+    with read_cursor() as cur:
+        cur.execute("SELECT file_path, offset, inode FROM file_state")
+        return {row["file_path"]: dict(row) for row in cur.fetchall()}
+
+
+EVENT_COLUMNS = (
+    "id",
+    "created_at",
+    "created_ts",
+    "file_path",
+    "raw_line",
+    "record_type",
+    "parse_ok",
+    "parse_error",
+    "device",
+    "seq",
+    "grp",
+    "values_json",
+    "value_count",
+    "value_min",
+    "value_max",
+    "value_avg",
+    "has_negative",
+    "rule_applied_ids_json",
+    "rule_applied_count",
+)
+
+EVENT_FILTERS = {
+    "device": "device = ?",
+    "grp": "grp = ?",
+    "file_path": "file_path = ?",
+    "parse_ok": "parse_ok = ?",
+    "record_type": "record_type = ?",
+}
+
+
+EVENT_COLUMN_ALIASES = {"values": "values_json", "rule_applied_ids": "rule_applied_ids_json"}
+
+
+def _first_id_at(cur, table, ts):
+    cur.execute(f"SELECT id FROM {table} WHERE created_ts >= ? ORDER BY created_ts, id LIMIT 1", (ts,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _id_bounds(cur, table, since, until):
+    low = high = None
+    if since is not None:
+        low = _first_id_at(cur, table, since)
+        if low is None:
+            return None
+    if until is not None:
+        high = _first_id_at(cur, table, until)
+    return low, high
+
+
+def query_events(filters=None, columns=None, before_id=None, limit=200):
+    columns = {EVENT_COLUMN_ALIASES.get(c, c) for c in columns or ()}
+    selected = [c for c in EVENT_COLUMNS if c in columns] or list(EVENT_COLUMNS)
+    if "id" not in selected:
+        selected.insert(0, "id")
+    where = []
+    params = []
+    for key, value in (filters or {}).items():
+        if value is None or key not in EVENT_FILTERS:
+            continue
+        where.append(EVENT_FILTERS[key])
+        params.append(value)
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(before_id)
+    filters = filters or {}
+    since = filters.get("since")
+    until = filters.get("until")
+    rows = []
+    with read_cursor() as cur:
+        for table in _event_tables(cur.connection, since, until):
+            table_where = list(where)
+            table_params = list(params)
+            if since is not None or until is not None:
+                bounds = _id_bounds(cur, table, since, until)
+                if bounds is None:
+                    continue
+                for clause, bound in zip(("id >= ?", "id < ?"), bounds):
+                    if bound is not None:
+                        table_where.append(clause)
+                        table_params.append(bound)
+            sql = f"SELECT {', '.join(selected)} FROM {table}"
+            if table_where:
+                sql += " WHERE " + " AND ".join(table_where)
+            cur.execute(sql + " ORDER BY id DESC LIMIT ?", table_params + [limit - len(rows)])
+            rows.extend(decode_event(dict(row)) for row in cur.fetchall())
+            if len(rows) >= limit:
+                break
+    return rows
+
+
+def prune_old_records(batch_size=None):
+    global _retention_stats
+    batch_size = batch_size or RETENTION_BATCH_SIZE
     cutoff = int(time.time()) - RETENTION_DAYS * 86400
-    with db_cursor() as cur:
-        cur.execute("DELETE FROM events WHERE strftime('%s', created_at) < ?", (cutoff,))
-        cur.execute("DELETE FROM alerts WHERE strftime('%s', created_at) < ?", (cutoff,))
-        cur.execute("DELETE FROM audit_log WHERE strftime('%s', created_at) < ?", (cutoff,))
+    started = time.monotonic()
+    removed = {}
+    if EVENT_PARTITION_HOURS > 0:
+        span = EVENT_PARTITION_HOURS * 3600
+        removed["partitions"] = 0
+        with db_cursor() as cur:
+            for key in list(_list_partitions()):
+                if key + span <= cutoff and _drop_partition(cur.connection, key):
+                    removed["partitions"] += 1
+    for table in EPOCH_TABLES:
+        removed[table] = 0
+        while True:
+            with db_cursor() as cur:
+                cur.execute(
+                    f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE created_ts < ? LIMIT ?)",
+                    (cutoff, batch_size),
+                )
+                deleted = cur.rowcount
+            removed[table] += deleted
+            if deleted < batch_size:
+                break
+            time.sleep(RETENTION_PAUSE_SEC)
+    elapsed = time.monotonic() - started
+    total = sum(removed.values())
+    _retention_stats = {
+        "finished_at": time.time(),
+        "cutoff": cutoff,
+        "removed": removed,
+        "elapsed_sec": round(elapsed, 3),
+        "rows_per_sec": round(total / elapsed, 1) if elapsed > 0 else None,
+    }
+    return _retention_stats
+
+
+def get_retention_stats():
+    return dict(_retention_stats)
+
+
+def _record_audits(cur, rows):
+    cur.executemany(
+        "INSERT INTO audit_log (created_ts, actor, action, detail, count) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
 
 
 def record_audit(actor, action, detail):
-    with db_cursor() as cur:
-        cur.execute(
-            "INSERT INTO audit_log (actor, action, detail) VALUES (?, ?, ?)",
-            (actor, action, detail),
-        )
+    now = time.time()
+    with _audit_lock:
+        if action in AUDIT_COLLAPSE_ACTIONS:
+            key = (actor, action, detail, int(now) // AUDIT_COLLAPSE_SEC)
+            row = _audit_collapsed.get(key)
+            if row is not None:
+                row[4] += 1
+                return
+            _audit_collapsed[key] = [int(now), actor, action, detail, 1]
+        else:
+            _audit_rows.append((int(now), actor, action, detail, 1))
+        if _audit_stats["oldest"] is None:
+            _audit_stats["oldest"] = now
+        full = len(_audit_rows) + len(_audit_collapsed) >= AUDIT_BUFFER_MAX
+    if full:
+        flush_audit()
+
+
+def flush_audit(max_age=None, force=False):
+    now = time.time()
+    with _audit_lock:
+        oldest = _audit_stats["oldest"]
+        if oldest is None or (max_age is not None and now - oldest < max_age):
+            return 0
+        rows = _audit_rows[:]
+        del _audit_rows[:]
+        interval = int(now) // AUDIT_COLLAPSE_SEC
+        full = len(rows) + len(_audit_collapsed) >= AUDIT_BUFFER_MAX
+        for key in list(_audit_collapsed):
+            if force or full or key[3] < interval:
+                rows.append(tuple(_audit_collapsed.pop(key)))
+        _audit_stats["oldest"] = now if _audit_collapsed else None
+        _audit_stats["flushed"] += len(rows)
+    if rows:
+        submit_write(_record_audits, rows)
+    return len(rows)
 
 
 def ensure_default_policies():
@@ -1,81 +1,269 @@
-import codecs
 import glob
+import logging
+import multiprocessing
 import os
+import queue
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+from app import counters, metrics
 from app.broadcast import publish_event
-from app.db import get_file_state, insert_event, update_file_state
-from app.parse import parse_line
+from app.db import insert_events, list_file_states
+from app.parse import parse_runs
 from app.profile import update_profile
 from app.rules import apply_rules
+from app.watch import create_watcher
 
 LOG_DIR = os.getenv("LOG_DIR", "./sample_logs")
 INCLUDE_GLOBS = os.getenv("INCLUDE_FILES", "*")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+INGEST_FLUSH_SEC = float(os.getenv("INGEST_FLUSH_SEC", "0.5"))
+READ_BLOCK_SIZE = int(os.getenv("READ_BLOCK_SIZE", "65536"))
+PARTIAL_LINE_TIMEOUT_SEC = float(os.getenv("PARTIAL_LINE_TIMEOUT_SEC", "10"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_PARSE_PROCESSES = int(os.getenv("INGEST_PARSE_PROCESSES", "0"))
+INGEST_WRITE_QUEUE = int(os.getenv("INGEST_WRITE_QUEUE", "64"))
+
+logger = logging.getLogger(__name__)
 
 status_lock = threading.Lock()
 file_status = {}
 
+_pool_lock = threading.Lock()
+_worker_pool = None
+_parse_pool = None
+_write_queue = queue.Queue(maxsize=INGEST_WRITE_QUEUE)
+_writer_thread = None
+_failed_paths = {}
+_file_states = None
+_state_lock = threading.Lock()
+_pending_tails = set()
+
+
+def _patterns():
+    return [p.strip() for p in INCLUDE_GLOBS.split(",") if p.strip()]
+
 
 def _iter_files():
-    patterns = [p.strip() for p in INCLUDE_GLOBS.split(",") if p.strip()]
-    for pattern in patterns:
+    for pattern in _patterns():
         for path in glob.glob(os.path.join(LOG_DIR, pattern)):
-            yield path
+            if os.path.isfile(path):
+                yield path
+
+
+def _get_state(path):
+    global _file_states
+    with _state_lock:
+        if _file_states is None:
+            _file_states = list_file_states()
+        return _file_states.get(path)
+
+
+def _set_state(path, offset, inode):
+    with _state_lock:
+        if _file_states is not None:
+            _file_states[path] = {"file_path": path, "offset": offset, "inode": inode}
+
+
+def _decode_line(data):
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("cp949", errors="replace")
 
 
-def _read_incremental(path, start_offset):
+def _iter_lines(path, start_offset, final=False, stop=None):
     with open(path, "rb") as handle:
         handle.seek(start_offset)
-        data = handle.read()
+        offset = start_offset
+        position = start_offset
+        pending = bytearray()
+        while stop is None or position < stop:
+            size = READ_BLOCK_SIZE if stop is None else min(READ_BLOCK_SIZE, stop - position)
+            block = handle.read(size)
+            if not block:
+                break
+            position += len(block)
+            pending.extend(block)
+            start = 0
+            while True:
+                end = pending.find(b"\n", start)
+                if end < 0:
+                    break
+                offset += end + 1 - start
+                yield _decode_line(pending[start:end]).rstrip("\r"), offset
+                start = end + 1
+            del pending[:start]
+        if final and pending and (stop is None or position == stop):
+            offset += len(pending)
+            yield _decode_line(pending).rstrip("\r"), offset
+
+
+def _apply_rules(path, lines):
+    started = metrics.start_timer()
+    runs = []
+    for line in lines:
+        context = {"file_path": path}
+        line, meta, applied_ids = apply_rules(line, context)
+        if meta.get("record_type") == "IGNORE":
+            continue
+        if not runs or runs[-1][0] != context:
+            runs.append((context, [], []))
+        runs[-1][1].append(line)
+        runs[-1][2].append(applied_ids)
+    metrics.observe_since("ingest_stage_seconds", started, stage="apply_rules")
+    return runs
+
+
+def _parse_chunk(path, lines):
+    runs = _apply_rules(path, lines)
+    started = metrics.start_timer()
+    if _parse_pool is not None:
+        payloads = _parse_pool.submit(parse_runs, path, runs).result()
+    else:
+        payloads = parse_runs(path, runs)
+    metrics.observe_since("ingest_stage_seconds", started, stage="parse")
+    return payloads
+
+
+def _start_pools():
+    global _worker_pool, _parse_pool
+    with _pool_lock:
+        if INGEST_PARSE_PROCESSES > 0 and _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=INGEST_PARSE_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+        if INGEST_WORKERS > 1 and _worker_pool is None:
+            _worker_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+
+def _stop_pools():
+    global _worker_pool, _parse_pool
+    with _pool_lock:
+        pools = (_worker_pool, _parse_pool)
+        _worker_pool = _parse_pool = None
+    for pool in pools:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _flush(path, batch, offset, inode):
+    flush_started = started = metrics.start_timer()
+    insert_events(batch, path, offset, inode)
+    _set_state(path, offset, inode)
+    counters.record_events(path, batch)
+    metrics.observe_since("ingest_stage_seconds", started, stage="insert")
+    started = metrics.start_timer()
+    for payload in batch:
+        if payload.get("parse_ok") and payload.get("values"):
+            update_profile(payload.get("device"), payload.get("grp"), payload.get("values"))
+    metrics.observe_since("ingest_stage_seconds", started, stage="profile")
+    started = metrics.start_timer()
+    for payload in batch:
+        publish_event(payload)
+    metrics.observe_since("ingest_stage_seconds", started, stage="publish")
+    metrics.observe_since("ingest_flush_seconds", flush_started, file=path)
+    metrics.inc("ingest_events_total", len(batch), file=path)
+
+
+def _ingest_file(path, flush):
     try:
-        decoder = codecs.getincrementaldecoder("utf-8")()
-        text = decoder.decode(data)
-        return text, len(data)
-    except UnicodeDecodeError:
-        decoder = codecs.getincrementaldecoder("cp949")()
-        text = decoder.decode(data)
-        return text, len(data)
-
-
-def ingest_once():
-    for path in _iter_files():
-        inode = str(os.stat(path).st_ino)
-        state = get_file_state(path)
-        offset = state["offset"] if state else 0
-        if state and state.get("inode") != inode:
-            offset = 0
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return "missing"
+    inode = str(stat.st_ino)
+    state = _get_state(path)
+    offset = state["offset"] if state else 0
+    if state and state.get("inode") != inode or stat.st_size < offset:
+        offset = 0
+    final = time.time() - stat.st_mtime >= PARTIAL_LINE_TIMEOUT_SEC
+    lines = []
+    chunk_started = time.monotonic()
+    read_any = False
+    start_offset = offset
+    try:
+        for line, offset in _iter_lines(path, offset, final, stat.st_size):
+            if not lines:
+                chunk_started = time.monotonic()
+            read_any = True
+            lines.append(line)
+            if len(lines) >= INGEST_BATCH_SIZE or time.monotonic() - chunk_started >= INGEST_FLUSH_SEC:
+                flush(path, _parse_chunk(path, lines), offset, inode)
+                lines = []
+    except FileNotFoundError:
+        return "missing"
+    if not final and offset < stat.st_size:
+        _pending_tails.add(path)
+    else:
+        _pending_tails.discard(path)
+    if not read_any:
+        return "idle"
+    flush(path, _parse_chunk(path, lines), offset, inode)
+    metrics.inc("ingest_bytes_total", offset - start_offset, file=path)
+    return "ok"
+
+
+def _writer_loop():
+    while True:
+        path, batch, offset, inode = _write_queue.get()
         try:
-            text, delta = _read_incremental(path, offset)
-        except FileNotFoundError:
-            _update_status(path, "missing")
-            continue
-        if not text:
-            _update_status(path, "idle")
+            if path not in _failed_paths:
+                _flush(path, batch, offset, inode)
+        except Exception as exc:
+            logger.exception("ingest flush failed for %s", path)
+            _failed_paths[path] = str(exc)
+        finally:
+            _write_queue.task_done()
+
+
+def _enqueue_flush(path, batch, offset, inode):
+    _write_queue.put((path, batch, offset, inode))
+
+
+def _ingest_parallel(paths):
+    global _writer_thread
+    if _writer_thread is None:
+        _writer_thread = threading.Thread(target=_writer_loop, name="ingest-writer", daemon=True)
+        _writer_thread.start()
+    _failed_paths.clear()
+    futures = {path: _worker_pool.submit(_ingest_file, path, _enqueue_flush) for path in paths}
+    statuses = {path: future.result() for path, future in futures.items()}
+    _write_queue.join()
+    for path, status in statuses.items():
+        if path in _failed_paths:
+            _update_status(path, "db_error", _failed_paths[path])
+        else:
+            _update_status(path, status)
+
+
+def ingest_once(paths=None):
+    if paths is None:
+        paths = list(_iter_files())
+    _start_pools()
+    if INGEST_WORKERS > 1:
+        _ingest_parallel(paths)
+        return
+    _failed_paths.clear()
+    for path in paths:
+        try:
+            status = _ingest_file(path, _flush)
+        except Exception as exc:
+            logger.exception("ingest flush failed for %s", path)
+            _failed_paths[path] = str(exc)
+            _update_status(path, "db_error", str(exc))
             continue
-        for line in text.splitlines():
-            context = {"file_path": path}
-            line, meta, applied_ids = apply_rules(line, context)
-            if meta.get("record_type") == "IGNORE":
-                continue
-            parsed = parse_line(line, context)
-            payload = {"file_path": path, **parsed}
-            payload["rule_applied_ids"] = applied_ids
-            payload["rule_applied_count"] = len(applied_ids)
-            insert_event(payload)
-            if parsed.get("parse_ok") and parsed.get("values"):
-                update_profile(parsed.get("device"), parsed.get("grp"), parsed.get("values"))
-            publish_event(payload)
-        update_file_state(path, offset + delta, inode)
-        _update_status(path, "ok")
-
-
-def _update_status(path, status):
+        _update_status(path, status)
+
+
+def _update_status(path, status, error=None):
     with status_lock:
         file_status[path] = {
             "status": status,
             "updated_at": time.time(),
         }
+        if error is not None:
+            file_status[path]["error"] = error
 
 
 def get_status_snapshot():
@@ -83,7 +271,38 @@ def get_status_snapshot():
         return {k: dict(v) for k, v in file_status.items()}
 
 
+def get_lag_snapshot():
+    with _state_lock:
+        states = dict(_file_states or {})
+    lag = {}
+    for path in get_status_snapshot():
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        state = states.get(path)
+        lag[path] = max(size - (state["offset"] if state else 0), 0)
+    return lag
+
+
+def _collect_metrics():
+    samples = [("ingest_lag_bytes", (("file", path),), lag) for path, lag in get_lag_snapshot().items()]
+    return [("ingest_lag_bytes", "gauge", samples)]
+
+
+metrics.register_collector(_collect_metrics)
+metrics.describe("ingest_stage_seconds", "Time spent per ingest chunk in each pipeline stage")
+metrics.describe("ingest_lag_bytes", "File size minus the committed read offset")
+
+
 def start_ingest_loop(stop_event):
-    while not stop_event.is_set():
-        ingest_once()
-        time.sleep(1)
+    watcher = create_watcher(LOG_DIR, _patterns(), lambda: list(_iter_files()))
+    try:
+        while not stop_event.is_set():
+            changed = watcher.poll(1.0)
+            paths = changed | set(_pending_tails) | set(_failed_paths)
+            if paths:
+                ingest_once(sorted(paths))
+    finally:
+        watcher.close()
+        _stop_pools()
@@ -3,31 +3,61 @@ import os
 import threading
 import time
 
-from fastapi import Depends, FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from app import alerts, profile
+from app import alerts, counters, metrics, profile
 from app.auth import require_admin, require_viewer
-from app.broadcast import iter_events
-from app.db import ensure_default_policies, init_db, list_recent_events, record_audit
-from app.ingest import get_status_snapshot, start_ingest_loop
+from app.broadcast import aiter_events, build_view, get_snapshot, get_stream_stats, latest_event_id
+from app.db import (
+    EVENT_COLUMNS,
+    AUDIT_FLUSH_SEC,
+    ensure_default_policies,
+    flush_audit,
+    flush_writes,
+    get_db_stats,
+    get_retention_stats,
+    init_db,
+    prune_old_records,
+    query_events,
+    record_audit,
+)
+from app.ingest import get_lag_snapshot, get_status_snapshot, start_ingest_loop
 from app.rules import delete_rule, save_rule, update_rule
 from app.profile import list_labels, save_label
+from app.transfer import import_config, iter_export
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
+RETENTION_INTERVAL_SEC = int(os.getenv("RETENTION_INTERVAL_SEC", "3600"))
+
 stop_event = threading.Event()
 
 
 def _alert_loop():
     while not stop_event.is_set():
         try:
-            alerts.evaluate_policies(get_status_snapshot())
+            alerts.evaluate_policies(get_status_snapshot(), get_lag_snapshot())
         except Exception as exc:
             alerts.record_db_error(exc)
-        time.sleep(5)
+        stop_event.wait(5)
+
+
+def _flush_loop():
+    while not stop_event.wait(1):
+        profile.flush_profiles(max_age=profile.PROFILE_FLUSH_SEC)
+        flush_audit(max_age=AUDIT_FLUSH_SEC)
+
+
+def _retention_loop():
+    while not stop_event.is_set():
+        try:
+            prune_old_records()
+        except Exception as exc:
+            alerts.record_db_error(exc)
+        stop_event.wait(RETENTION_INTERVAL_SEC)
 
 
 @app.on_event("startup")
@@ -36,11 +66,17 @@ def startup():
     ensure_default_policies()
     threading.Thread(target=start_ingest_loop, args=(stop_event,), daemon=True).start()
     threading.Thread(target=_alert_loop, daemon=True).start()
+    threading.Thread(target=alerts.run_dispatcher, args=(stop_event,), daemon=True).start()
+    threading.Thread(target=_retention_loop, daemon=True).start()
+    threading.Thread(target=_flush_loop, daemon=True).start()
 
 
 @app.on_event("shutdown")
 def shutdown():
     stop_event.set()
+    profile.flush_profiles()
+    flush_audit(force=True)
+    flush_writes(timeout=5)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -56,26 +92,99 @@ def admin(role=Depends(require_admin)):
         return handle.read()
 
 
+EVENT_QUERY_PARAMS = {
+    "device": ("device", str),
+    "grp": ("grp", int),
+    "file": ("file_path", str),
+    "parse_ok": ("parse_ok", int),
+    "record_type": ("record_type", str),
+    "since": ("since", float),
+    "until": ("until", float),
+}
+
+
+def _int_param(params, name, default=None):
+    value = params.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"invalid {name}")
+
+
 @app.get("/api/events")
-def api_events(role=Depends(require_viewer)):
-    return JSONResponse(list_recent_events())
+def api_events(request: Request, role=Depends(require_viewer)):
+    params = request.query_params
+    filters = {}
+    for param, (key, cast) in EVENT_QUERY_PARAMS.items():
+        value = params.get(param)
+        if value in (None, ""):
+            continue
+        try:
+            filters[key] = cast(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"invalid {param}")
+    limit = min(max(_int_param(params, "limit", 200), 1), 1000)
+    before_id = _int_param(params, "before_id")
+    columns = [c.strip() for c in params.get("fields", "").split(",") if c.strip()]
+    if not columns and params.get("raw") in ("0", "false"):
+        columns = [c for c in EVENT_COLUMNS if c != "raw_line"]
+    stream_id = latest_event_id()
+    rows = query_events(filters, columns, before_id, limit)
+    headers = {"X-Last-Event-ID": str(stream_id)}
+    if len(rows) == limit:
+        headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return JSONResponse(rows, headers=headers)
 
 
 @app.get("/api/stream")
-def api_stream(role=Depends(require_viewer)):
-    return StreamingResponse(iter_events(), media_type="text/event-stream")
+async def api_stream(request: Request, role=Depends(require_viewer)):
+    last_event_id = request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id")
+    filters, projection = build_view(request.query_params)
+    return StreamingResponse(
+        aiter_events(last_event_id, request.is_disconnected, filters, projection),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/snapshot")
+def api_snapshot(request: Request, role=Depends(require_viewer)):
+    filters, projection = build_view(request.query_params)
+    items, last_event_id = get_snapshot(filters, projection)
+    return JSONResponse({"last_event_id": last_event_id, "events": items})
+
+
+@app.get("/metrics")
+def metrics_endpoint(role=Depends(require_admin)):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/admin/api/status")
 def admin_status(role=Depends(require_admin)):
-    return JSONResponse(get_status_snapshot())
+    return JSONResponse(
+        {
+            "files": get_status_snapshot(),
+            "retention": get_retention_stats(),
+            "db": get_db_stats(),
+            "profile": profile.get_profile_stats(),
+            "alerts": alerts.get_outbox_stats(),
+            "counters": counters.get_counter_stats(),
+        }
+    )
+
+
+@app.get("/admin/api/stream")
+def admin_stream(role=Depends(require_admin)):
+    return JSONResponse(get_stream_stats())
 
 
 @app.get("/admin/api/rules")
 def admin_rules(role=Depends(require_admin)):
-    from app.db import db_cursor
+    from app.db import read_cursor
 
-    with db_cursor() as cur:
+    with read_cursor() as cur:
         cur.execute("SELECT * FROM parse_rules ORDER BY priority, id")
         return JSONResponse([dict(row) for row in cur.fetchall()])
 
@@ -135,26 +244,17 @@ def admin_preview(payload: dict, role=Depends(require_admin)):
 
 
 @app.get("/admin/api/export")
-def admin_export(role=Depends(require_admin)):
-    from app.db import db_cursor
-
-    with db_cursor() as cur:
-        cur.execute("SELECT * FROM parse_rules")
-        rules = [dict(row) for row in cur.fetchall()]
-        cur.execute("SELECT * FROM value_labels")
-        labels = [dict(row) for row in cur.fetchall()]
-    return JSONResponse({"rules": rules, "labels": labels})
+def admin_export(include_profiles: bool = False, role=Depends(require_admin)):
+    return StreamingResponse(iter_export(include_profiles), media_type="application/json")
 
 
 @app.post("/admin/api/import")
 def admin_import(payload: dict, role=Depends(require_admin)):
-    rules = payload.get("rules", [])
-    labels = payload.get("labels", [])
-    for rule in rules:
-        save_rule(rule, actor=role)
-    for label in labels:
-        save_label(label, actor=role)
-    return JSONResponse({"ok": True})
+    try:
+        summary = import_config(payload, actor=role)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return JSONResponse({"ok": True, "imported": summary})
 
 
 @app.get("/health")
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+
+METRICS_TIMING = os.getenv("METRICS_TIMING", "1").lower() not in ("0", "false", "no")
+METRIC_PREFIX = "logtail_"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_help = {}
+_collectors = []
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def start_timer():
+    return time.perf_counter() if METRICS_TIMING else None
+
+
+def observe(name, seconds, buckets=LATENCY_BUCKETS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0]
+        counts = entry[1]
+        for pos, bound in enumerate(buckets):
+            if seconds <= bound:
+                counts[pos] += 1
+                break
+        else:
+            counts[-1] += 1
+        entry[2] += seconds
+
+
+def observe_since(name, started, **labels):
+    if started is not None:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def register_collector(collector):
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def histogram_samples(name, labels, buckets, counts, total):
+    samples = []
+    running = 0
+    for bound, count in zip(buckets, counts):
+        running += count
+        samples.append((f"{name}_bucket", labels + (("le", _format_value(float(bound))),), running))
+    running += counts[-1]
+    samples.append((f"{name}_bucket", labels + (("le", "+Inf"),), running))
+    samples.append((f"{name}_sum", labels, total))
+    samples.append((f"{name}_count", labels, running))
+    return samples
+
+
+def render():
+    families = {}
+    with _lock:
+        for (name, labels), value in _counters.items():
+            families.setdefault(name, ["counter", []])[1].append((name, labels, value))
+        for (name, labels), (buckets, counts, total) in _histograms.items():
+            families.setdefault(name, ["histogram", []])[1].extend(
+                histogram_samples(name, labels, buckets, counts, total)
+            )
+    for collector in list(_collectors):
+        for name, kind, samples in collector():
+            families.setdefault(name, [kind, []])[1].extend(samples)
+    lines = []
+    for name in sorted(families):
+        kind, samples = families[name]
+        full = METRIC_PREFIX + name
+        if name in _help:
+            lines.append(f"# HELP {full} {_help[name]}")
+        lines.append(f"# TYPE {full} {kind}")
+        for sample, labels, value in samples:
+            lines.append(f"{METRIC_PREFIX}{sample}{_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
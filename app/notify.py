@@ -1,26 +1,78 @@
+import http.client
 import json
 import os
-import urllib.request
+import threading
+import time
+import urllib.parse
+
+from app import metrics
 
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
 WEBHOOK_TIMEOUT_SEC = int(os.getenv("WEBHOOK_TIMEOUT_SEC", "5"))
 WEBHOOK_DISABLE = os.getenv("WEBHOOK_DISABLE", "0") == "1"
 
+_lock = threading.Lock()
+_connection = None
+_connection_key = None
+
+
+def _connect(url):
+    global _connection, _connection_key
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme, parts.netloc, WEBHOOK_TIMEOUT_SEC)
+    if _connection is None or _connection_key != key:
+        _close()
+        factory = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        _connection = factory(parts.netloc, timeout=WEBHOOK_TIMEOUT_SEC)
+        _connection_key = key
+        return _connection, True
+    return _connection, False
+
+
+def _close():
+    global _connection, _connection_key
+    if _connection is not None:
+        _connection.close()
+    _connection = None
+    _connection_key = None
+
+
+def _post(url, data):
+    parts = urllib.parse.urlsplit(url)
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    while True:
+        connection, fresh = _connect(url)
+        try:
+            connection.request("POST", target, body=data, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            _close()
+            if fresh:
+                raise
+            continue
+        except Exception:
+            _close()
+            raise
+        if response.will_close:
+            _close()
+        return response
+
 
 def send_slack(payload):
     if WEBHOOK_DISABLE or not WEBHOOK_URL:
         return {"ok": False, "error": "disabled"}
     data = json.dumps(payload).encode("utf-8")
-    request = urllib.request.Request(
-        WEBHOOK_URL,
-        data=data,
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-    try:
-        with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT_SEC) as response:
-            return {"ok": response.status < 300, "status": response.status, "headers": dict(response.headers)}
-    except urllib.error.HTTPError as exc:
-        return {"ok": False, "status": exc.code, "headers": dict(exc.headers)}
-    except Exception as exc:
-        return {"ok": False, "error": str(exc)}
+    started = time.perf_counter()
+    with _lock:
+        try:
+            response = _post(WEBHOOK_URL, data)
+            result = {"ok": response.status < 300, "status": response.status, "headers": dict(response.getheaders())}
+        except Exception as exc:
+            result = {"ok": False, "error": str(exc) or type(exc).__name__}
+    result["elapsed"] = time.perf_counter() - started
+    metrics.observe("webhook_request_seconds", result["elapsed"])
+    metrics.inc("webhook_requests_total", status=result.get("status", "error"))
+    return result
@@ -1,10 +1,20 @@
-import json
+import os
 import re
 from statistics import mean
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 NUMERIC_RE = re.compile(r"[-+]?\d+(?:\.\d+)?")
 TOKEN_RE = re.compile(r"[A-Za-z0-9_-]+")
 
+PARSE_NUMPY_MIN_BATCH = int(os.getenv("PARSE_NUMPY_MIN_BATCH", "256"))
+EXACT_FLOAT_INT = 1 << 53
+SHORT_FIELDS = ("raw_line", "record_type", "parse_ok", "parse_error")
+ROW_FIELDS = SHORT_FIELDS + ("device", "seq", "grp")
+
 
 def detect_delimiter(line, override=None):
     if override:
@@ -104,5 +114,213 @@ def parse_line(line, context):
     }
 
 
-def to_values_json(values):
-    return json.dumps(values)
+def exact_mean(values):
+    count = len(values)
+    if all(type(v) is int for v in values):
+        total = sum(values)
+        return total // count if total % count == 0 else total / count
+    try:
+        ratios = [v.as_integer_ratio() for v in values]
+    except (OverflowError, ValueError):
+        return mean(values)
+    scale = max(d for _, d in ratios)
+    return sum(n * (scale // d) for n, d in ratios) / (scale * count)
+
+
+def _convert(matches):
+    try:
+        return [float(m) if "." in m else int(m) for m in matches], True
+    except ValueError:
+        values = []
+        for m in matches:
+            try:
+                values.append(float(m) if "." in m else int(m))
+            except ValueError:
+                pass
+        return values, False
+
+
+def parse_lines(lines, context):
+    override = context.get("delimiter_override")
+    drop_indexes = context.get("drop_indexes", [])
+    coerce_numeric = context.get("coerce_numeric")
+    valuecount_range = context.get("valuecount_range")
+    joinable = not override or not any(ch in "+-." or ch.isdigit() for ch in override)
+    findall = NUMERIC_RE.findall
+    rows = []
+    full = []
+    kinds = []
+    offsets = [0]
+    flat = []
+    for line in lines:
+        raw_line = line.rstrip("\r\n")
+        stripped = raw_line.strip()
+        if stripped.startswith("#") or stripped.lower().startswith("header"):
+            rows.append((raw_line, "HEADER", 1, None, None, None, None))
+        elif not stripped:
+            rows.append((raw_line, "IGNORE", 1, None, None, None, None))
+        else:
+            delimiter = override or (";" if ";" in raw_line else "\t" if "\t" in raw_line else None)
+            tokens = raw_line.split(delimiter, 3) if joinable else raw_line.split(delimiter)
+            if len(tokens) < 3:
+                rows.append((raw_line, "UNKNOWN", 0, "not_enough_fields", None, None, None))
+            else:
+                try:
+                    seq = int(tokens[1].strip())
+                    grp = int(tokens[2].strip())
+                except ValueError:
+                    rows.append((raw_line, "DATA", 0, "seq_or_grp_invalid", None, None, None))
+                else:
+                    if len(tokens) < 4:
+                        matches = []
+                    elif joinable:
+                        matches = findall(tokens[3])
+                    else:
+                        matches = [m for token in tokens[3:] for m in findall(token)]
+                    values, ok = _convert(matches)
+                    if drop_indexes:
+                        values = [v for idx, v in enumerate(values) if idx not in drop_indexes]
+                    if coerce_numeric:
+                        values = [float(v) for v in values]
+                        kind = 1
+                    elif any("." in m for m in matches):
+                        kind = 1 if all("." in m for m in matches) else 2
+                    else:
+                        kind = 0
+                    parse_error = None if ok else "value_parse_error"
+                    if valuecount_range:
+                        min_v, max_v = valuecount_range
+                        if (min_v is not None and len(values) < min_v) or (max_v is not None and len(values) > max_v):
+                            parse_error = "value_count_out_of_range"
+                    rows.append((raw_line, "DATA", 0 if parse_error else 1, parse_error, clean_device(tokens[0]), seq, grp))
+                    flat.extend(values)
+                    offsets.append(len(flat))
+                    full.append(len(rows) - 1)
+                    kinds.append(kind)
+    columns = {name: [] for name in ROW_FIELDS}
+    if rows:
+        columns.update(zip(ROW_FIELDS, map(list, zip(*rows))))
+    columns["values"] = flat
+    columns["offsets"] = offsets
+    columns["full"] = full
+    stats = None
+    if np is not None and len(full) >= PARSE_NUMPY_MIN_BATCH:
+        stats = _value_stats_numpy(flat, offsets, kinds)
+    if stats is None:
+        stats = _value_stats(flat, offsets)
+    columns["value_count"], columns["value_min"], columns["value_max"], columns["value_avg"], columns["has_negative"] = stats
+    return columns
+
+
+def _value_stats(flat, offsets):
+    counts = []
+    mins = []
+    maxs = []
+    avgs = []
+    negatives = []
+    for start, end in zip(offsets, offsets[1:]):
+        counts.append(end - start)
+        if start == end:
+            mins.append(None)
+            maxs.append(None)
+            avgs.append(None)
+            negatives.append(0)
+            continue
+        values = flat[start:end]
+        low = min(values)
+        mins.append(low)
+        maxs.append(max(values))
+        avgs.append(exact_mean(values))
+        negatives.append(int(low < 0))
+    return counts, mins, maxs, avgs, negatives
+
+
+def _value_stats_numpy(flat, offsets, kinds):
+    try:
+        values = np.array(flat, dtype=np.float64)
+    except OverflowError:
+        return None
+    bounds = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(bounds)
+    nonempty = counts > 0
+    starts = bounds[:-1][nonempty]
+    if not len(starts):
+        return _value_stats(flat, offsets)
+    lows = np.minimum.reduceat(values, starts)
+    highs = np.maximum.reduceat(values, starts)
+    sums = np.add.reduceat(values, starts)
+    magnitudes = np.add.reduceat(np.abs(values), starts)
+    row_kinds = np.asarray(kinds, dtype=np.int8)[nonempty]
+    exact_ints = (row_kinds == 0) & (magnitudes <= EXACT_FLOAT_INT)
+    plain_floats = (row_kinds == 1) & (lows != 0) & (highs != 0)
+    lows_list = lows.tolist()
+    highs_list = highs.tolist()
+    sums_list = sums.tolist()
+    int_rows = exact_ints.tolist()
+    float_rows = plain_floats.tolist()
+    count_list = counts.tolist()
+    mins = []
+    maxs = []
+    avgs = []
+    negatives = []
+    row = 0
+    for pos, count in enumerate(count_list):
+        if not count:
+            mins.append(None)
+            maxs.append(None)
+            avgs.append(None)
+            negatives.append(0)
+            continue
+        if int_rows[row]:
+            low = int(lows_list[row])
+            total = int(sums_list[row])
+            mins.append(low)
+            maxs.append(int(highs_list[row]))
+            avgs.append(total // count if total % count == 0 else total / count)
+        else:
+            start = offsets[pos]
+            row_values = flat[start : start + count]
+            if float_rows[row]:
+                low = lows_list[row]
+                maxs.append(highs_list[row])
+            else:
+                low = min(row_values)
+                maxs.append(max(row_values))
+            mins.append(low)
+            avgs.append(exact_mean(row_values))
+        negatives.append(int(low < 0))
+        row += 1
+    return count_list, mins, maxs, avgs, negatives
+
+
+def iter_parsed(columns):
+    full = columns["full"]
+    values = columns["values"]
+    offsets = columns["offsets"]
+    next_full = 0
+    for pos, record in enumerate(zip(*(columns[name] for name in SHORT_FIELDS))):
+        parsed = dict(zip(SHORT_FIELDS, record))
+        if next_full < len(full) and full[next_full] == pos:
+            row = next_full
+            next_full += 1
+            parsed["device"] = columns["device"][pos]
+            parsed["seq"] = columns["seq"][pos]
+            parsed["grp"] = columns["grp"][pos]
+            parsed["values"] = values[offsets[row] : offsets[row + 1]]
+            parsed["value_count"] = columns["value_count"][row]
+            parsed["value_min"] = columns["value_min"][row]
+            parsed["value_max"] = columns["value_max"][row]
+            parsed["value_avg"] = columns["value_avg"][row]
+            parsed["has_negative"] = columns["has_negative"][row]
+        yield parsed
+
+
+def parse_runs(file_path, runs):
+    payloads = []
+    for context, run_lines, run_ids in runs:
+        for parsed, applied_ids in zip(iter_parsed(parse_lines(run_lines, context)), run_ids):
+            payload = {"file_path": file_path, **parsed}
+            payload["rule_applied_ids"] = applied_ids
+            payload["rule_applied_count"] = len(applied_ids)
+            payloads.append(payload)
+    return payloads
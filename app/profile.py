@@ -1,79 +1,308 @@
+import bisect
 import math
+import os
+import struct
+import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict
 
-from app.db import db_cursor, record_audit
+from app.db import execute_write, read_cursor, record_audit, submit_write
 
-_profile_cache = defaultdict(list)
+PROFILE_SKETCH_SIZE = int(os.getenv("PROFILE_SKETCH_SIZE", "64"))
+PROFILE_FLUSH_SAMPLES = int(os.getenv("PROFILE_FLUSH_SAMPLES", "50"))
+PROFILE_FLUSH_SEC = float(os.getenv("PROFILE_FLUSH_SEC", "30"))
+PROFILE_BUFFER_MAX_BYTES = int(os.getenv("PROFILE_BUFFER_MAX_BYTES", str(16 * 1024 * 1024)))
+
+HASH_MASK = (1 << 64) - 1
+STATE_BYTES = 400
+INDEX_BYTES = 200 + 44 * PROFILE_SKETCH_SIZE
+
+_profile_cache = OrderedDict()
+_profile_lock = threading.Lock()
+_buffer_stats = {"samples": 0, "bytes": 0, "flushes": 0, "evictions": 0}
+
+
+def _hash_value(value):
+    if isinstance(value, float):
+        if value.is_integer():
+            value = int(value)
+        else:
+            value = struct.unpack("<q", struct.pack("<d", value))[0]
+    z = (value + 0x9E3779B97F4A7C15) & HASH_MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & HASH_MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & HASH_MASK
+    return z ^ (z >> 31)
+
+
+def _sketch_add(sketch, value):
+    h = _hash_value(value)
+    if len(sketch) >= PROFILE_SKETCH_SIZE and h >= sketch[-1]:
+        return
+    pos = bisect.bisect_left(sketch, h)
+    if pos < len(sketch) and sketch[pos] == h:
+        return
+    sketch.insert(pos, h)
+    if len(sketch) > PROFILE_SKETCH_SIZE:
+        sketch.pop()
+
+
+def _sketch_merge(left, right):
+    return sorted(set(left) | set(right))[:PROFILE_SKETCH_SIZE]
+
+
+def _sketch_estimate(sketch):
+    if len(sketch) < PROFILE_SKETCH_SIZE:
+        return len(sketch)
+    return round((PROFILE_SKETCH_SIZE - 1) * (HASH_MASK + 1) / (sketch[-1] + 1))
+
+
+def _sketch_dump(sketch):
+    return struct.pack(f"<{len(sketch)}Q", *sketch)
+
+
+def _sketch_load(data):
+    if not data:
+        return []
+    return list(struct.unpack(f"<{len(data) // 8}Q", data))
+
+
+class RunningStats:
+    __slots__ = ("count", "mean", "m2", "min", "max", "negative", "sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.negative = 0
+        self.sketch = []
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value < 0:
+            self.negative += 1
+        _sketch_add(self.sketch, value)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max, self.negative = other.min, other.max, other.negative
+            self.sketch = list(other.sketch)
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.negative += other.negative
+        self.sketch = _sketch_merge(self.sketch, other.sketch)
+
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def unique_count(self):
+        return _sketch_estimate(self.sketch)
+
+    @classmethod
+    def from_row(cls, row):
+        stats = cls()
+        stats.count = row["sample_count"]
+        stats.mean = row["avg"]
+        stats.m2 = row["m2"]
+        stats.min = row["min"]
+        stats.max = row["max"]
+        stats.negative = row["negative_count"]
+        stats.sketch = _sketch_load(row["sketch"])
+        return stats
+
+
+class ProfileState:
+    __slots__ = ("samples", "value_count_sum", "indexes", "started")
+
+    def __init__(self):
+        self.samples = 0
+        self.value_count_sum = 0
+        self.indexes = {}
+        self.started = time.monotonic()
+
+    def add(self, values):
+        self.samples += 1
+        self.value_count_sum += len(values)
+        indexes = self.indexes
+        added = 0
+        for idx, value in enumerate(values):
+            stats = indexes.get(idx)
+            if stats is None:
+                stats = indexes[idx] = RunningStats()
+                added += 1
+            stats.add(value)
+        return added
+
+    def nbytes(self):
+        return STATE_BYTES + INDEX_BYTES * len(self.indexes)
 
 
 def update_profile(device, grp, values):
     key = (device, grp)
-    _profile_cache[key].append(values)
-    if len(_profile_cache[key]) >= 50:
-        _flush_profile(device, grp)
+    evicted = []
+    with _profile_lock:
+        state = _profile_cache.get(key)
+        if state is None:
+            state = _profile_cache[key] = ProfileState()
+            _buffer_stats["bytes"] += STATE_BYTES
+        else:
+            _profile_cache.move_to_end(key)
+        _buffer_stats["bytes"] += INDEX_BYTES * state.add(values)
+        _buffer_stats["samples"] += 1
+        if state.samples >= PROFILE_FLUSH_SAMPLES:
+            evicted.append((key, _pop_state(key)))
+        while _buffer_stats["bytes"] > PROFILE_BUFFER_MAX_BYTES and _profile_cache:
+            oldest = next(iter(_profile_cache))
+            evicted.append((oldest, _pop_state(oldest)))
+            _buffer_stats["evictions"] += 1
+    for (device, grp), state in evicted:
+        _write_state(device, grp, state)
 
 
-def _flush_profile(device, grp):
-    samples = _profile_cache.pop((device, grp), [])
-    if not samples:
+def _pop_state(key):
+    state = _profile_cache.pop(key, None)
+    if state is not None:
+        _buffer_stats["samples"] -= state.samples
+        _buffer_stats["bytes"] -= state.nbytes()
+    return state
+
+
+def _write_state(device, grp, state):
+    if state is None or not state.samples:
         return
-    typical_value_count = round(sum(len(v) for v in samples) / len(samples))
-    by_index = defaultdict(list)
-    for values in samples:
-        for idx, value in enumerate(values):
-            by_index[idx].append(value)
-    with db_cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO value_profile (device, grp, typical_value_count, updated_at)
-            VALUES (?, ?, ?, datetime('now'))
-            ON CONFLICT(device, grp) DO UPDATE SET
-                typical_value_count=excluded.typical_value_count,
-                updated_at=datetime('now')
-            """,
-            (device, grp, typical_value_count),
-        )
-        for idx, values in by_index.items():
-            min_v = min(values)
-            max_v = max(values)
-            avg_v = sum(values) / len(values)
-            std_v = math.sqrt(sum((v - avg_v) ** 2 for v in values) / len(values))
-            unique_count = len(set(values))
-            is_binary = int(unique_count <= 2)
-            is_constant = int(unique_count == 1)
-            negative_rate = sum(1 for v in values if v < 0) / len(values)
-            cur.execute(
-                """
-                INSERT INTO value_profile_index (
-                    device, grp, idx, min, max, avg, std, unique_count,
-                    is_binary, is_constant, negative_rate, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
-                ON CONFLICT(device, grp, idx) DO UPDATE SET
-                    min=excluded.min,
-                    max=excluded.max,
-                    avg=excluded.avg,
-                    std=excluded.std,
-                    unique_count=excluded.unique_count,
-                    is_binary=excluded.is_binary,
-                    is_constant=excluded.is_constant,
-                    negative_rate=excluded.negative_rate,
-                    updated_at=datetime('now')
-                """,
-                (
-                    device,
-                    grp,
-                    idx,
-                    min_v,
-                    max_v,
-                    avg_v,
-                    std_v,
-                    unique_count,
-                    is_binary,
-                    is_constant,
-                    negative_rate,
-                ),
+    _buffer_stats["flushes"] += 1
+    submit_write(_write_profile, device, grp, state)
+
+
+def _flush_profile(device, grp):
+    with _profile_lock:
+        state = _pop_state((device, grp))
+    _write_state(device, grp, state)
+
+
+def flush_profiles(max_age=None):
+    now = time.monotonic()
+    with _profile_lock:
+        keys = [
+            key
+            for key, state in _profile_cache.items()
+            if max_age is None or now - state.started >= max_age
+        ]
+        states = [(key, _pop_state(key)) for key in keys]
+    for (device, grp), state in states:
+        _write_state(device, grp, state)
+    return len(states)
+
+
+def get_profile_stats():
+    with _profile_lock:
+        return {
+            "keys": len(_profile_cache),
+            "buffered_samples": _buffer_stats["samples"],
+            "memory_bytes": _buffer_stats["bytes"],
+            "memory_cap_bytes": PROFILE_BUFFER_MAX_BYTES,
+            "flushes": _buffer_stats["flushes"],
+            "evictions": _buffer_stats["evictions"],
+        }
+
+
+def _write_profile(cur, device, grp, state):
+    cur.execute(
+        "SELECT sample_count, value_count_sum FROM value_profile WHERE device = ? AND grp = ?",
+        (device, grp),
+    )
+    row = cur.fetchone()
+    samples = state.samples
+    value_count_sum = state.value_count_sum
+    if row and row["sample_count"]:
+        samples += row["sample_count"]
+        value_count_sum += row["value_count_sum"]
+    cur.execute(
+        """
+        INSERT INTO value_profile (device, grp, typical_value_count, sample_count, value_count_sum, updated_at)
+        VALUES (?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT(device, grp) DO UPDATE SET
+            typical_value_count=excluded.typical_value_count,
+            sample_count=excluded.sample_count,
+            value_count_sum=excluded.value_count_sum,
+            updated_at=datetime('now')
+        """,
+        (device, grp, round(value_count_sum / samples), samples, value_count_sum),
+    )
+    cur.execute(
+        """
+        SELECT idx, sample_count, avg, m2, min, max, negative_count, sketch
+        FROM value_profile_index WHERE device = ? AND grp = ? AND sample_count IS NOT NULL
+        """,
+        (device, grp),
+    )
+    merged = {}
+    for row in cur.fetchall():
+        merged[row["idx"]] = RunningStats.from_row(row)
+    index_rows = []
+    for idx, stats in state.indexes.items():
+        total = merged.get(idx) or RunningStats()
+        total.merge(stats)
+        unique_count = total.unique_count()
+        index_rows.append(
+            (
+                device,
+                grp,
+                idx,
+                total.min,
+                total.max,
+                total.mean,
+                total.std(),
+                unique_count,
+                int(unique_count <= 2),
+                int(total.min == total.max),
+                total.negative / total.count,
+                total.count,
+                total.m2,
+                total.negative,
+                _sketch_dump(total.sketch),
             )
+        )
+    cur.executemany(
+        """
+        INSERT INTO value_profile_index (
+            device, grp, idx, min, max, avg, std, unique_count, is_binary, is_constant,
+            negative_rate, sample_count, m2, negative_count, sketch, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT(device, grp, idx) DO UPDATE SET
+            min=excluded.min,
+            max=excluded.max,
+            avg=excluded.avg,
+            std=excluded.std,
+            unique_count=excluded.unique_count,
+            is_binary=excluded.is_binary,
+            is_constant=excluded.is_constant,
+            negative_rate=excluded.negative_rate,
+            sample_count=excluded.sample_count,
+            m2=excluded.m2,
+            negative_count=excluded.negative_count,
+            sketch=excluded.sketch,
+            updated_at=datetime('now')
+        """,
+        index_rows,
+    )
 
 
 def suggest_labels(device, grp, typical_value_count):
@@ -86,31 +315,43 @@ def suggest_labels(device, grp, typical_value_count):
     return suggestions
 
 
+def upsert_label(cur, label):
+    cur.execute(
+        """
+        INSERT INTO value_labels (device, grp, idx, label, unit, note, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT(device, grp, idx) DO UPDATE SET
+            label=excluded.label,
+            unit=excluded.unit,
+            note=excluded.note,
+            updated_at=datetime('now')
+        """,
+        (
+            label["device"],
+            label["grp"],
+            label["idx"],
+            label["label"],
+            label.get("unit"),
+            label.get("note"),
+        ),
+    )
+
+
+def validate_label(label):
+    if not isinstance(label, dict):
+        raise ValueError("label must be an object")
+    missing = [key for key in ("device", "grp", "idx", "label") if label.get(key) is None]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    return {**label, "grp": int(label["grp"]), "idx": int(label["idx"])}
+
+
 def save_label(label, actor="system"):
-    with db_cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO value_labels (device, grp, idx, label, unit, note, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
-            ON CONFLICT(device, grp, idx) DO UPDATE SET
-                label=excluded.label,
-                unit=excluded.unit,
-                note=excluded.note,
-                updated_at=datetime('now')
-            """,
-            (
-                label["device"],
-                label["grp"],
-                label["idx"],
-                label["label"],
-                label.get("unit"),
-                label.get("note"),
-            ),
-        )
+    execute_write(upsert_label, label)
     record_audit(actor, "LABEL_UPSERT", str(label))
 
 
 def list_labels():
-    with db_cursor() as cur:
+    with read_cursor() as cur:
         cur.execute("SELECT * FROM value_labels ORDER BY device, grp, idx")
         return [dict(row) for row in cur.fetchall()]
@@ -1,18 +1,138 @@
 import json
+import logging
 import os
 import re
 import time
-from app.db import db_cursor, record_audit
+from collections import defaultdict, namedtuple
+from operator import attrgetter
+
+from app.db import execute_write, read_cursor, record_audit
 
 RULE_RELOAD_SEC = int(os.getenv("RULE_RELOAD_SEC", "10"))
 
+CompiledRule = namedtuple("CompiledRule", ["order", "id", "rule_type", "regex", "action"])
+RulePlan = namedtuple("RulePlan", ["global_rules", "file_rules", "device_rules", "global_steps", "merged"])
+MatchGroup = namedtuple("MatchGroup", ["regex", "rules"])
+
+MATCH_RECORD_TYPES = {"IGNORE_LINE_REGEX": "IGNORE", "FORCE_HEADER_REGEX": "HEADER"}
+REGEX_RULE_TYPES = ("IGNORE_LINE_REGEX", "FORCE_HEADER_REGEX", "DEVICE_REWRITE_REGEX", "LINE_REPLACE_REGEX")
+RULE_TYPES = REGEX_RULE_TYPES + (
+    "DELIMITER_OVERRIDE",
+    "VALUECOUNT_RANGE_ENFORCE",
+    "DROP_VALUE_INDEXES",
+    "COERCE_NUMERIC",
+)
+SCOPE_TYPES = ("GLOBAL", "FILE", "DEVICE")
+
 _last_load = 0.0
 _cache = []
+_plan = RulePlan((), {}, {}, (), {})
+_bad_patterns = set()
+
+logger = logging.getLogger(__name__)
+
+
+def _compile_rule(order, rule):
+    regex = None
+    if rule.get("pattern"):
+        try:
+            regex = re.compile(rule["pattern"])
+        except re.error as exc:
+            if (rule["id"], rule["pattern"]) not in _bad_patterns:
+                _bad_patterns.add((rule["id"], rule["pattern"]))
+                logger.warning("rule %s skipped: invalid pattern %r: %s", rule["id"], rule["pattern"], exc)
+    try:
+        action = json.loads(rule.get("action_json") or "{}")
+    except ValueError:
+        action = {}
+    return CompiledRule(order, rule["id"], rule["rule_type"], regex, action)
+
+
+def _literal_prefix(pattern):
+    if "|" in pattern:
+        return ""
+    chars = []
+    i = 1 if pattern.startswith("^") else 0
+    while i < len(pattern):
+        ch = pattern[i]
+        step = 1
+        if ch == "\\":
+            ch = pattern[i + 1 : i + 2]
+            if not ch or ch.isalnum():
+                break
+            step = 2
+        elif ch in ".^$*+?{}[]()":
+            break
+        following = pattern[i + step : i + step + 1]
+        if following and following in "*?{":
+            break
+        chars.append(ch)
+        i += step
+        if following == "+":
+            break
+    return "".join(chars)
+
+
+def _combine(rules):
+    if len(rules) < 2:
+        return [rule for rule, _ in rules]
+    literals = sorted({literal for _, literal in rules}, key=len, reverse=True)
+    regex = re.compile("|".join(re.escape(literal) for literal in literals))
+    return [MatchGroup(regex, tuple(rule for rule, _ in rules))]
+
+
+def _build_steps(rules):
+    steps = []
+    pending = []
+    for rule in rules:
+        if rule.rule_type in MATCH_RECORD_TYPES:
+            if rule.regex is None:
+                continue
+            literal = _literal_prefix(rule.regex.pattern) if rule.regex.flags == re.UNICODE else ""
+            if literal:
+                pending.append((rule, literal))
+                continue
+        steps.extend(_combine(pending))
+        pending = []
+        steps.append(rule)
+    steps.extend(_combine(pending))
+    return tuple(steps)
+
+
+def _match_group(group, line):
+    if not group.regex.search(line):
+        return None
+    for rule in group.rules:
+        if rule.regex.search(line):
+            return rule
+    return None
 
 
-def _load_rules():
-    global _cache, _last_load
-    with db_cursor() as cur:
+def _build_plan(rules):
+    global_rules = []
+    file_rules = defaultdict(list)
+    device_rules = defaultdict(list)
+    for order, rule in enumerate(rules):
+        scope_type = rule.get("scope_type", "GLOBAL")
+        scope_value = rule.get("scope_value")
+        if scope_type == "GLOBAL":
+            global_rules.append(_compile_rule(order, rule))
+        elif scope_type == "FILE" and scope_value:
+            file_rules[scope_value].append(_compile_rule(order, rule))
+        elif scope_type == "DEVICE" and scope_value:
+            device_rules[scope_value].append(_compile_rule(order, rule))
+    return RulePlan(
+        tuple(global_rules),
+        {key: tuple(value) for key, value in file_rules.items()},
+        {key: tuple(value) for key, value in device_rules.items()},
+        _build_steps(global_rules),
+        {},
+    )
+
+
+def load_rules():
+    global _cache, _plan, _last_load
+    with read_cursor() as cur:
         cur.execute(
             """
             SELECT * FROM parse_rules
@@ -21,93 +141,142 @@ def _load_rules():
             """
         )
         _cache = [dict(row) for row in cur.fetchall()]
+    _plan = _build_plan(_cache)
     _last_load = time.time()
 
 
-def get_rules():
+def get_plan():
     if time.time() - _last_load > RULE_RELOAD_SEC:
-        _load_rules()
-    return _cache
+        load_rules()
+    return _plan
+
+
+def _steps_for(plan, context):
+    if not plan.file_rules and not plan.device_rules:
+        return plan.global_steps
+    file_rules = plan.file_rules.get(context.get("file_path"), ())
+    device_rules = plan.device_rules.get(context.get("device"), ())
+    if not file_rules and not device_rules:
+        return plan.global_steps
+    key = (context.get("file_path"), context.get("device"))
+    steps = plan.merged.get(key)
+    if steps is None:
+        steps = _build_steps(sorted(plan.global_rules + file_rules + device_rules, key=attrgetter("order")))
+        plan.merged[key] = steps
+    return steps
 
 
 def apply_rules(line, context):
     applied_ids = []
-    for rule in get_rules():
-        if not _scope_match(rule, context):
-            continue
-        rule_type = rule["rule_type"]
-        pattern = rule.get("pattern")
-        action = json.loads(rule.get("action_json") or "{}")
+    for step in _steps_for(get_plan(), context):
+        if type(step) is MatchGroup:
+            rule = _match_group(step, line)
+            if rule is None:
+                continue
+            applied_ids.append(rule.id)
+            return line, {"record_type": MATCH_RECORD_TYPES[rule.rule_type], "parse_ok": 1}, applied_ids
+        rule = step
+        rule_type = rule.rule_type
+        regex = rule.regex
+        action = rule.action
         if rule_type == "IGNORE_LINE_REGEX":
-            if pattern and re.search(pattern, line):
-                applied_ids.append(rule["id"])
+            if regex and regex.search(line):
+                applied_ids.append(rule.id)
                 return line, {"record_type": "IGNORE", "parse_ok": 1}, applied_ids
         elif rule_type == "FORCE_HEADER_REGEX":
-            if pattern and re.search(pattern, line):
-                applied_ids.append(rule["id"])
+            if regex and regex.search(line):
+                applied_ids.append(rule.id)
                 return line, {"record_type": "HEADER", "parse_ok": 1}, applied_ids
         elif rule_type == "DEVICE_REWRITE_REGEX":
-            if pattern:
-                line, n = re.subn(pattern, action.get("replace", ""), line)
+            if regex:
+                line, n = regex.subn(action.get("replace", ""), line)
                 if n:
-                    applied_ids.append(rule["id"])
+                    applied_ids.append(rule.id)
         elif rule_type == "LINE_REPLACE_REGEX":
-            if pattern:
-                line, n = re.subn(pattern, action.get("replace", ""), line)
+            if regex:
+                line, n = regex.subn(action.get("replace", ""), line)
                 if n:
-                    applied_ids.append(rule["id"])
+                    applied_ids.append(rule.id)
         elif rule_type == "DELIMITER_OVERRIDE":
             if action.get("delimiter"):
                 context["delimiter_override"] = action["delimiter"]
-                applied_ids.append(rule["id"])
+                applied_ids.append(rule.id)
         elif rule_type == "VALUECOUNT_RANGE_ENFORCE":
             min_v = action.get("min")
             max_v = action.get("max")
             context["valuecount_range"] = (min_v, max_v)
-            applied_ids.append(rule["id"])
+            applied_ids.append(rule.id)
         elif rule_type == "DROP_VALUE_INDEXES":
             context["drop_indexes"] = action.get("indexes", [])
-            applied_ids.append(rule["id"])
+            applied_ids.append(rule.id)
         elif rule_type == "COERCE_NUMERIC":
             context["coerce_numeric"] = True
-            applied_ids.append(rule["id"])
+            applied_ids.append(rule.id)
     return line, {}, applied_ids
 
 
-def _scope_match(rule, context):
-    scope_type = rule.get("scope_type", "GLOBAL")
-    scope_value = rule.get("scope_value")
-    if scope_type == "GLOBAL":
-        return True
-    if scope_type == "FILE":
-        return scope_value and scope_value == context.get("file_path")
-    if scope_type == "DEVICE":
-        return scope_value and scope_value == context.get("device")
-    return False
+def insert_rule(cur, rule):
+    cur.execute(
+        """
+        INSERT INTO parse_rules (enabled, priority, mode, scope_type, scope_value,
+            rule_type, pattern, action_json, note, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+        """,
+        (
+            rule.get("enabled", 1),
+            rule.get("priority", 100),
+            rule.get("mode", "ACTIVE"),
+            rule.get("scope_type", "GLOBAL"),
+            rule.get("scope_value"),
+            rule.get("rule_type"),
+            rule.get("pattern"),
+            json.dumps(rule.get("action", {})),
+            rule.get("note"),
+        ),
+    )
+
+
+def validate_rule(rule):
+    if not isinstance(rule, dict):
+        raise ValueError("rule must be an object")
+    rule_type = rule.get("rule_type")
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"unknown rule_type {rule_type!r}")
+    scope_type = rule.get("scope_type") or "GLOBAL"
+    if scope_type not in SCOPE_TYPES:
+        raise ValueError(f"unknown scope_type {scope_type!r}")
+    if scope_type != "GLOBAL" and not rule.get("scope_value"):
+        raise ValueError(f"{scope_type} scope needs a scope_value")
+    pattern = rule.get("pattern")
+    if rule_type in REGEX_RULE_TYPES and not pattern:
+        raise ValueError(f"{rule_type} needs a pattern")
+    if pattern:
+        try:
+            re.compile(pattern)
+        except re.error as exc:
+            raise ValueError(f"invalid pattern {pattern!r}: {exc}")
+    action = rule.get("action")
+    if action is None:
+        action = json.loads(rule.get("action_json") or "{}")
+    if not isinstance(action, dict):
+        raise ValueError("action must be an object")
+    return {
+        **rule,
+        "enabled": int(rule.get("enabled", 1)),
+        "priority": int(rule.get("priority", 100)),
+        "scope_type": scope_type,
+        "action": action,
+    }
 
 
 def save_rule(rule, actor="system"):
-    with db_cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO parse_rules (enabled, priority, mode, scope_type, scope_value,
-                rule_type, pattern, action_json, note, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
-            """,
-            (
-                rule.get("enabled", 1),
-                rule.get("priority", 100),
-                rule.get("mode", "ACTIVE"),
-                rule.get("scope_type", "GLOBAL"),
-                rule.get("scope_value"),
-                rule.get("rule_type"),
-                rule.get("pattern"),
-                json.dumps(rule.get("action", {})),
-                rule.get("note"),
-            ),
-        )
+    execute_write(insert_rule, rule)
     record_audit(actor, "RULE_CREATE", json.dumps(rule, ensure_ascii=False))
-    _load_rules()
+    load_rules()
+
+
+def _update_rule(cur, columns, values):
+    cur.execute(f"UPDATE parse_rules SET {', '.join(columns)} WHERE id = ?", values)
 
 
 def update_rule(rule_id, updates, actor="system"):
@@ -122,14 +291,16 @@ def update_rule(rule_id, updates, actor="system"):
             values.append(value)
     columns.append("updated_at = datetime('now')")
     values.append(rule_id)
-    with db_cursor() as cur:
-        cur.execute(f"UPDATE parse_rules SET {', '.join(columns)} WHERE id = ?", values)
+    execute_write(_update_rule, columns, values)
     record_audit(actor, "RULE_UPDATE", json.dumps({"id": rule_id, "updates": updates}, ensure_ascii=False))
-    _load_rules()
+    load_rules()
+
+
+def _delete_rule(cur, rule_id):
+    cur.execute("DELETE FROM parse_rules WHERE id = ?", (rule_id,))
 
 
 def delete_rule(rule_id, actor="system"):
-    with db_cursor() as cur:
-        cur.execute("DELETE FROM parse_rules WHERE id = ?", (rule_id,))
+    execute_write(_delete_rule, rule_id)
     record_audit(actor, "RULE_DELETE", json.dumps({"id": rule_id}, ensure_ascii=False))
-    _load_rules()
+    load_rules()
@@ -0,0 +1,157 @@
+import base64
+import json
+import os
+
+from app import rules
+from app.db import execute_write, read_cursor, record_audit
+from app.profile import upsert_label, validate_label
+
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "500"))
+
+SECTIONS = (("rules", "parse_rules"), ("labels", "value_labels"))
+PROFILE_SECTIONS = (("value_profile", "value_profile"), ("value_profile_index", "value_profile_index"))
+PROFILE_KEYS = {"value_profile": ("device", "grp"), "value_profile_index": ("device", "grp", "idx")}
+PROFILE_NUMERIC = {
+    "typical_value_count": int,
+    "sample_count": int,
+    "value_count_sum": int,
+    "negative_count": int,
+    "unique_count": int,
+    "is_binary": int,
+    "is_constant": int,
+    "grp": int,
+    "idx": int,
+    "min": float,
+    "max": float,
+    "avg": float,
+    "std": float,
+    "m2": float,
+    "negative_rate": float,
+}
+PROFILE_STATE = {
+    "value_profile": ("value_count_sum",),
+    "value_profile_index": ("avg", "m2", "min", "max", "negative_count"),
+}
+
+
+def _export_row(row):
+    item = dict(row)
+    del item["_rowid"]
+    for key, value in item.items():
+        if isinstance(value, bytes):
+            item[key] = base64.b64encode(value).decode("ascii")
+    return item
+
+
+def iter_export(include_profiles=False):
+    sections = SECTIONS + (PROFILE_SECTIONS if include_profiles else ())
+    for pos, (name, table) in enumerate(sections):
+        yield ("{" if pos == 0 else ", ") + json.dumps(name) + ": ["
+        last = 0
+        first = True
+        while True:
+            with read_cursor() as cur:
+                cur.execute(
+                    f"SELECT rowid AS _rowid, * FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, EXPORT_FETCH_ROWS),
+                )
+                rows = cur.fetchall()
+            if not rows:
+                break
+            last = rows[-1]["_rowid"]
+            chunk = ", ".join(json.dumps(_export_row(row), ensure_ascii=False) for row in rows)
+            yield chunk if first else ", " + chunk
+            first = False
+        yield "]"
+    yield "}\n"
+
+
+def _table_columns():
+    with read_cursor() as cur:
+        columns = {}
+        for _, table in PROFILE_SECTIONS:
+            cur.execute(f"PRAGMA table_info({table})")
+            columns[table] = {row["name"]: (row["type"] or "").upper() for row in cur.fetchall()}
+    return columns
+
+
+def _validate_profile_row(row, table, columns):
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    unknown = [key for key in row if key not in columns]
+    if unknown:
+        raise ValueError(f"unknown columns {', '.join(unknown)}")
+    missing = [key for key in PROFILE_KEYS[table] if row.get(key) is None]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if row.get("sample_count") is not None:
+        missing = [key for key in PROFILE_STATE[table] if row.get(key) is None]
+        if missing:
+            raise ValueError(f"sample_count needs {', '.join(missing)}")
+    item = dict(row)
+    for key, value in item.items():
+        kind = PROFILE_NUMERIC.get(key)
+        if kind is not None and value is not None:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"{key} must be a number")
+            if kind is int and value != int(value):
+                raise ValueError(f"{key} must be an integer")
+            item[key] = kind(value)
+        elif columns[key] == "BLOB" and value is not None:
+            if not isinstance(value, str):
+                raise ValueError(f"{key} must be base64 text")
+            item[key] = base64.b64decode(value, validate=True)
+            if len(item[key]) % 8:
+                raise ValueError(f"{key} length must be a multiple of 8")
+    if (item.get("sample_count") or 0) < 0:
+        raise ValueError("sample_count must not be negative")
+    return item
+
+
+def validate_import(payload):
+    if not isinstance(payload, dict):
+        raise ValueError("payload must be an object")
+    validated = {}
+    validators = {"rules": rules.validate_rule, "labels": validate_label}
+    columns = None
+    for name, table in SECTIONS + PROFILE_SECTIONS:
+        items = payload.get(name) or []
+        if not isinstance(items, list):
+            raise ValueError(f"{name} must be a list")
+        if name in PROFILE_KEYS and items and columns is None:
+            columns = _table_columns()
+        checked = []
+        for pos, item in enumerate(items):
+            try:
+                if name in PROFILE_KEYS:
+                    checked.append(_validate_profile_row(item, table, columns[table]))
+                else:
+                    checked.append(validators[name](item))
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f"{name}[{pos}]: {exc}")
+        validated[name] = checked
+    return validated
+
+
+def _import_all(cur, validated):
+    for rule in validated["rules"]:
+        rules.insert_rule(cur, rule)
+    for label in validated["labels"]:
+        upsert_label(cur, label)
+    for name, table in PROFILE_SECTIONS:
+        for row in validated[name]:
+            names = list(row)
+            cur.execute(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})",
+                [row[key] for key in names],
+            )
+
+
+def import_config(payload, actor="system"):
+    validated = validate_import(payload)
+    execute_write(_import_all, validated)
+    summary = {name: len(items) for name, items in validated.items()}
+    record_audit(actor, "IMPORT", json.dumps(summary))
+    if validated["rules"]:
+        rules.load_rules()
+    return summary
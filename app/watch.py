@@ -0,0 +1,131 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import stat
+import struct
+import sys
+import time
+
+WATCH_MODE = os.getenv("WATCH_MODE", "auto")
+WATCH_POLL_SEC = float(os.getenv("WATCH_POLL_SEC", "1"))
+WATCH_RESCAN_SEC = float(os.getenv("WATCH_RESCAN_SEC", "60"))
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class StatWatcher:
+    mode = "stat"
+
+    def __init__(self, list_files):
+        self._list_files = list_files
+        self._seen = {}
+        self._next_scan = 0.0
+
+    def _scan(self):
+        current = {}
+        for path in self._list_files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                current[path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        changed = {path for path, sig in current.items() if self._seen.get(path) != sig}
+        self._seen = current
+        return changed
+
+    def poll(self, timeout):
+        delay = self._next_scan - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            if time.monotonic() < self._next_scan:
+                return set()
+        self._next_scan = time.monotonic() + WATCH_POLL_SEC
+        return self._scan()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    mode = "inotify"
+
+    def __init__(self, directory, patterns, list_files):
+        self._directory = directory
+        self._patterns = patterns
+        self._list_files = list_files
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+        self._next_rescan = 0.0
+
+    def _matches(self, name):
+        if name.startswith("."):
+            return False
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self._patterns)
+
+    def _read_events(self):
+        changed = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + _EVENT_HEADER.size <= len(data):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(data, pos)
+                pos += _EVENT_HEADER.size
+                name = data[pos : pos + length].rstrip(b"\0")
+                pos += length
+                if mask & (IN_Q_OVERFLOW | IN_IGNORED):
+                    rescan = True
+                elif name:
+                    decoded = os.fsdecode(name)
+                    if self._matches(decoded):
+                        changed.add(os.path.join(self._directory, decoded))
+        return changed, rescan
+
+    def poll(self, timeout):
+        now = time.monotonic()
+        if now >= self._next_rescan:
+            self._next_rescan = now + WATCH_RESCAN_SEC
+            self._read_events()
+            return set(self._list_files())
+        readable, _, _ = select.select([self._fd], [], [], min(timeout, self._next_rescan - now))
+        if not readable:
+            return set()
+        changed, rescan = self._read_events()
+        if rescan:
+            self._next_rescan = 0.0
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def create_watcher(directory, patterns, list_files):
+    mode = WATCH_MODE
+    if mode == "auto":
+        mode = "inotify" if sys.platform.startswith("linux") else "stat"
+    if mode == "inotify" and not any(os.sep in p or "/" in p for p in patterns):
+        try:
+            return InotifyWatcher(directory, patterns, list_files)
+        except (OSError, AttributeError):
+            pass
+    return StatWatcher(list_files)
@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+_workdir = tempfile.mkdtemp(prefix="ingest_bench_")
+os.environ["DB_PATH"] = os.path.join(_workdir, "bench.db")
+os.environ["LOG_DIR"] = os.path.join(_workdir, "logs")
+os.environ.setdefault("INCLUDE_FILES", "teraterm-*")
+
+from app import broadcast, ingest  # noqa: E402
+from app.db import flush_writes, init_db, read_cursor  # noqa: E402
+
+from bench.loggen import LogGenerator, append_at_rate, write_logs  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGES = ("apply_rules", "parse_runs", "insert_events", "update_profile", "publish_event")
+
+_stage_sec = defaultdict(float)
+_stage_calls = defaultdict(int)
+
+
+def _timed(name, func):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _stage_sec[name] += time.perf_counter() - started
+            _stage_calls[name] += 1
+
+    return wrapper
+
+
+def _instrument():
+    for name in STAGES:
+        setattr(ingest, name, _timed(name, getattr(ingest, name)))
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _db_stats():
+    flush_writes()
+    with read_cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM events")
+        events = cur.fetchone()[0]
+        cur.execute("PRAGMA page_count")
+        pages = cur.fetchone()[0]
+        cur.execute("PRAGMA page_size")
+        page_size = cur.fetchone()[0]
+    return events, pages * page_size
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]  # noqa: E731
+    return {
+        "p50": round(statistics.median(ordered) * 1000, 3),
+        "p95": round(pick(95) * 1000, 3),
+        "p99": round(pick(99) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def run_backfill(files, lines, seed):
+    paths = write_logs(os.environ["LOG_DIR"], files, lines, seed)
+    raw_bytes = sum(os.path.getsize(path) for path in paths)
+    _stage_sec.clear()
+    _stage_calls.clear()
+    started = time.perf_counter()
+    ingest.ingest_once()
+    flush_writes()
+    elapsed = time.perf_counter() - started
+    events, db_bytes = _db_stats()
+    staged = sum(_stage_sec.values())
+    return {
+        "files": files,
+        "lines": files * lines,
+        "raw_bytes": raw_bytes,
+        "elapsed_sec": round(elapsed, 3),
+        "lines_per_sec": round(files * lines / elapsed, 1),
+        "events": events,
+        "db_bytes": db_bytes,
+        "db_bytes_per_event": round(db_bytes / events, 1) if events else None,
+        "stages_sec": {name: round(_stage_sec[name], 3) for name in STAGES},
+        "stage_calls": {name: _stage_calls[name] for name in STAGES},
+        "other_sec": round(max(elapsed - staged, 0), 3),
+    }
+
+
+def run_latency(rate, duration, seed):
+    sent_at = {}
+    latencies = []
+    stop_event = threading.Event()
+    broadcast.STREAM_HEARTBEAT_SEC = 0.2
+
+    async def stopped():
+        return stop_event.is_set()
+
+    async def read_stream():
+        async for chunk in broadcast.aiter_events(None, stopped):
+            received = time.time()
+            for line in chunk.split("\n"):
+                if not line.startswith("data: "):
+                    continue
+                payload = json.loads(line[6:])
+                sent = sent_at.get(payload.get("seq"))
+                if sent is not None and payload.get("file_path") == path:
+                    latencies.append(received - sent)
+
+    def consume():
+        asyncio.run(read_stream())
+
+    path = os.path.join(os.environ["LOG_DIR"], "teraterm-bench-live")
+    open(path, "wb").close()
+    loop = threading.Thread(target=ingest.start_ingest_loop, args=(stop_event,), daemon=True)
+    consumer = threading.Thread(target=consume, daemon=True)
+    loop.start()
+    consumer.start()
+    time.sleep(1.5)
+    generator = LogGenerator(seed + 1, header_rate=0)
+    sent = append_at_rate([path], rate, duration, generator, lambda seq, ts: sent_at.__setitem__(seq, ts))
+    time.sleep(2)
+    stop_event.set()
+    loop.join(timeout=5)
+    consumer.join(timeout=5)
+    return {
+        "rate": rate,
+        "duration_sec": duration,
+        "appended": sent,
+        "delivered": len(latencies),
+        "latency_ms": _percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="end-to-end ingest benchmark")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=25000, help="lines per file for the backfill run")
+    parser.add_argument("--rate", type=float, default=200, help="lines per second for the latency run, 0 = skip")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report to this path")
+    args = parser.parse_args()
+    init_db()
+    _instrument()
+    result = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "INGEST_BATCH_SIZE": ingest.INGEST_BATCH_SIZE,
+            "INGEST_WORKERS": ingest.INGEST_WORKERS,
+            "VALUE_ENCODING": os.getenv("VALUE_ENCODING", "json"),
+        },
+        "backfill": run_backfill(args.files, args.lines, args.seed),
+    }
+    if args.rate > 0:
+        result["latency"] = run_latency(args.rate, args.duration, args.seed)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import random
+import time
+
+DEVICES = ["DEV_A", "DEV_B", "DEV_C", "DEV_D", "DEV_E", "DEV_F", "PLC_01", "PLC_02"]
+NOISE_PREFIXES = ["noise", "\ufeff", "??", ">>"]
+KOREAN_NOTES = ["장비 정상", "경고 발생", "센서 점검", "재시작 완료"]
+HEADERS = ["# Header line", "HEADER: sample", "# teraterm log start"]
+
+
+class LogGenerator:
+    def __init__(self, seed=1, header_rate=0.01, noise_rate=0.05, cp949_rate=0.02, float_rate=0.2):
+        self.rng = random.Random(seed)
+        self.header_rate = header_rate
+        self.noise_rate = noise_rate
+        self.cp949_rate = cp949_rate
+        self.float_rate = float_rate
+        self.seq = 0
+
+    def _values(self):
+        rng = self.rng
+        count = rng.randint(3, 12)
+        if rng.random() < self.float_rate:
+            return [f"{rng.uniform(-50, 500):.{rng.randint(1, 2)}f}" for _ in range(count)]
+        return [str(rng.randint(-20, 1000)) for _ in range(count)]
+
+    def line(self):
+        rng = self.rng
+        if rng.random() < self.header_rate:
+            return HEADERS[rng.randrange(len(HEADERS))].encode("ascii")
+        self.seq += 1
+        device = DEVICES[rng.randrange(len(DEVICES))]
+        if rng.random() < self.noise_rate:
+            device = NOISE_PREFIXES[rng.randrange(len(NOISE_PREFIXES))] + device
+        delimiter = rng.choice((";", "\t", " "))
+        fields = [device, str(self.seq), str(rng.randint(1, 20)), *self._values()]
+        text = delimiter.join(fields)
+        if rng.random() < self.cp949_rate:
+            return text.encode("utf-8") + delimiter.encode() + KOREAN_NOTES[rng.randrange(len(KOREAN_NOTES))].encode("cp949")
+        return text.encode("utf-8")
+
+    def lines(self, count):
+        return b"".join(self.line() + b"\r\n" for _ in range(count))
+
+
+def log_paths(directory, files, prefix="teraterm-bench"):
+    return [os.path.join(directory, f"{prefix}-{i:04d}") for i in range(files)]
+
+
+def write_logs(directory, files, lines, seed=1, **options):
+    os.makedirs(directory, exist_ok=True)
+    generator = LogGenerator(seed, **options)
+    paths = log_paths(directory, files)
+    for path in paths:
+        with open(path, "wb") as handle:
+            remaining = lines
+            while remaining:
+                chunk = min(remaining, 10000)
+                handle.write(generator.lines(chunk))
+                remaining -= chunk
+    return paths
+
+
+def append_at_rate(paths, rate, duration, generator=None, on_line=None):
+    generator = generator or LogGenerator()
+    handles = [open(path, "ab") for path in paths]
+    interval = 1.0 / rate
+    started = time.monotonic()
+    sent = 0
+    try:
+        while time.monotonic() - started < duration:
+            seq = generator.seq
+            line = generator.line()
+            handle = handles[sent % len(handles)]
+            handle.write(line + b"\r\n")
+            handle.flush()
+            if on_line is not None and generator.seq != seq:
+                on_line(generator.seq, time.time())
+            sent += 1
+            delay = started + sent * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    finally:
+        for handle in handles:
+            handle.close()
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="synthetic teraterm log generator")
+    parser.add_argument("directory")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=10000, help="lines written to each file up front")
+    parser.add_argument("--rate", type=float, default=0, help="lines per second appended afterwards, 0 = none")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cp949-rate", type=float, default=0.02)
+    args = parser.parse_args()
+    paths = write_logs(args.directory, args.files, args.lines, args.seed, cp949_rate=args.cp949_rate)
+    print(f"wrote {args.files} x {args.lines} lines to {args.directory}")
+    if args.rate > 0:
+        sent = append_at_rate(paths, args.rate, args.duration, LogGenerator(args.seed + 1, cp949_rate=args.cp949_rate))
+        print(f"appended {sent} lines at {args.rate}/s")
+
+
+if __name__ == "__main__":
+    main()
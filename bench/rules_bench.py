@@ -0,0 +1,72 @@
+import argparse
+import os
+import tempfile
+import time
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="rules_bench_"), "bench.db")
+
+from app import rules  # noqa: E402
+from app.db import db_cursor, init_db  # noqa: E402
+
+RULE_TEMPLATES = [
+    ("IGNORE_LINE_REGEX", r"^#skip{i}\b", {}),
+    ("FORCE_HEADER_REGEX", r"^HDR{i}:", {}),
+    ("LINE_REPLACE_REGEX", r";;{i};", {"replace": ";"}),
+    ("DEVICE_REWRITE_REGEX", r"^noise{i}", {"replace": ""}),
+]
+
+SAMPLE_LINES = [
+    "DEV_A;1;10;100;200;-1; 419",
+    "DEV_A\t2\t10\t1\t2\t3",
+    "DEV_B 3 11 9 8 7",
+    "noiseDEV_D;5;12;5;6;7",
+    "HEADER: sample",
+]
+
+
+def _install_rules(count, templates):
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM parse_rules")
+    for i in range(count):
+        rule_type, pattern, action = templates[i % len(templates)]
+        scoped = i % 2 == 1
+        rules.save_rule(
+            {
+                "priority": i,
+                "scope_type": "FILE" if scoped else "GLOBAL",
+                "scope_value": f"./logs/other-{i}.log" if scoped else None,
+                "rule_type": rule_type,
+                "pattern": pattern.format(i=i),
+                "action": action,
+            },
+            actor="bench",
+        )
+
+
+def run(rule_counts, lines, templates=RULE_TEMPLATES):
+    init_db()
+    results = {}
+    for count in rule_counts:
+        _install_rules(count, templates)
+        started = time.perf_counter()
+        for i in range(lines):
+            rules.apply_rules(SAMPLE_LINES[i % len(SAMPLE_LINES)], {"file_path": "./logs/teraterm.log"})
+        elapsed = time.perf_counter() - started
+        results[count] = lines / elapsed
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="apply_rules throughput")
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--rules", default="0,10,100")
+    parser.add_argument("--match-only", action="store_true", help="only IGNORE/FORCE_HEADER rules")
+    args = parser.parse_args()
+    counts = [int(v) for v in args.rules.split(",") if v.strip()]
+    templates = RULE_TEMPLATES[:2] if args.match_only else RULE_TEMPLATES
+    for count, rate in run(counts, args.lines, templates).items():
+        print(f"rules={count:<4d} lines/sec={rate:,.0f}")
+
+
+if __name__ == "__main__":
+    main()
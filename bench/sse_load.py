@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+_workdir = tempfile.mkdtemp(prefix="sse_load_")
+os.environ["DB_PATH"] = os.path.join(_workdir, "bench.db")
+os.environ["LOG_DIR"] = _workdir
+os.environ["INCLUDE_FILES"] = "none-*"
+
+import uvicorn  # noqa: E402
+
+from app import broadcast  # noqa: E402
+from app.auth import VIEWER_PASS, VIEWER_USER  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def _client(port, expected, latencies, ready):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    token = base64.b64encode(f"{VIEWER_USER}:{VIEWER_PASS}".encode()).decode()
+    writer.write(
+        f"GET /api/stream HTTP/1.1\r\nHost: localhost\r\nAuthorization: Basic {token}\r\n"
+        "Accept: text/event-stream\r\n\r\n".encode()
+    )
+    await writer.drain()
+    await reader.readuntil(b"\r\n\r\n")
+    ready.release()
+    received = 0
+    while received < expected:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.startswith(b"data: {"):
+            payload = json.loads(line[6:])
+            latencies.append(time.time() - payload["ts"])
+            received += 1
+    writer.close()
+    return received
+
+
+def _publisher(events, rate):
+    interval = 1.0 / rate if rate else 0
+    for seq in range(events):
+        broadcast.publish_event({"seq": seq, "ts": time.time(), "raw_line": "DEV_A;1;10;1;2;3"})
+        if interval:
+            time.sleep(interval)
+
+
+async def _run(port, clients, events, rate):
+    latencies = []
+    ready = asyncio.Semaphore(0)
+    tasks = [asyncio.create_task(_client(port, events, latencies, ready)) for _ in range(clients)]
+    for _ in range(clients):
+        await ready.acquire()
+    await asyncio.sleep(0.2)
+    threads = threading.active_count()
+    started = time.perf_counter()
+    publisher = threading.Thread(target=_publisher, args=(events, rate), daemon=True)
+    publisher.start()
+    received = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    return latencies, sum(received), elapsed, threads
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE fan-out load test")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=100, help="events per second, 0 = as fast as possible")
+    args = parser.parse_args()
+    port = _free_port()
+    server, thread = _start_server(port)
+    latencies, received, elapsed, threads = asyncio.run(_run(port, args.clients, args.events, args.rate))
+    server.should_exit = True
+    thread.join(timeout=5)
+    result = {
+        "clients": args.clients,
+        "events": args.events,
+        "delivered": received,
+        "expected": args.clients * args.events,
+        "elapsed_sec": round(elapsed, 3),
+        "threads_while_connected": threads,
+        "latency_ms": {
+            "p50": round(statistics.median(latencies) * 1000, 3) if latencies else None,
+            "p95": round(_percentile(latencies, 95) * 1000, 3) if latencies else None,
+            "p99": round(_percentile(latencies, 99) * 1000, 3) if latencies else None,
+            "max": round(max(latencies) * 1000, 3) if latencies else None,
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
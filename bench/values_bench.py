@@ -0,0 +1,53 @@
+import argparse
+import json
+import random
+import time
+
+from app.codec import pack_values, unpack_values
+
+
+def _sample_values(rng):
+    count = rng.randint(3, 24)
+    kind = rng.random()
+    if kind < 0.6:
+        return [rng.randint(-50, 1000) for _ in range(count)]
+    if kind < 0.75:
+        return [rng.randint(0, 1) for _ in range(count)]
+    if kind < 0.95:
+        return [round(rng.uniform(-100, 100), rng.randint(1, 3)) for _ in range(count)]
+    return [rng.randint(-5, 5) if i % 2 else round(rng.uniform(0, 10), 2) for i in range(count)]
+
+
+def _measure(encode, decode, samples):
+    started = time.perf_counter()
+    encoded = [encode(values) for values in samples]
+    encode_sec = time.perf_counter() - started
+    started = time.perf_counter()
+    for data in encoded:
+        decode(data)
+    decode_sec = time.perf_counter() - started
+    size = sum(len(data) for data in encoded)
+    return {
+        "bytes_per_event": round(size / len(samples), 2),
+        "encode_us": round(encode_sec / len(samples) * 1e6, 3),
+        "decode_us": round(decode_sec / len(samples) * 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="values_json vs packed encoding")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    samples = [_sample_values(rng) for _ in range(args.events)]
+    result = {
+        "events": args.events,
+        "json": _measure(lambda v: json.dumps(v).encode("utf-8"), json.loads, samples),
+        "packed": _measure(pack_values, unpack_values, samples),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,149 @@
+import time
+
 from app.alerts import _dedup_key
 
 
 def test_dedup_key():
     key = _dedup_key("POL", "file")
     assert key == "POL:file"
+
+
+def test_dedup_key_device():
+    assert _dedup_key("POL", None, "DEV") == "POL:device:DEV"
+
+
+def test_parse_fail_rate_per_device(monkeypatch):
+    from uuid import uuid4
+
+    from app import alerts, counters
+
+    device = f"DEV_{uuid4().hex[:8]}"
+    now = time.time()
+    counters.record_events("path-" + device, [{"device": device, "parse_ok": False}] * 3, now)
+    sent = []
+    monkeypatch.setattr(alerts, "dispatch_alert", lambda policy, context: sent.append(context))
+    alerts._check_parse_fail_rate({"name": "PARSE_FAIL_RATE"}, {"rate": 0.5, "scopes": ["device"]}, 60)
+    assert any(context["device"] == device and context["file_path"] is None for context in sent)
+
+
+def test_outbox_retries_429_and_timeout(monkeypatch):
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from uuid import uuid4
+
+    from app import alerts, notify
+    from app.db import flush_writes, init_db, read_cursor
+
+    replies = ["429", "timeout", "200"]
+    hits = []
+
+    class Stub(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            reply = replies[min(len(hits), len(replies) - 1)]
+            hits.append(reply)
+            if reply == "timeout":
+                time.sleep(0.5)
+                return
+            self.send_response(int(reply))
+            if reply == "429":
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    init_db()
+    monkeypatch.setattr(notify, "WEBHOOK_URL", f"http://127.0.0.1:{server.server_port}/hook")
+    monkeypatch.setattr(notify, "WEBHOOK_DISABLE", False)
+    monkeypatch.setattr(notify, "WEBHOOK_TIMEOUT_SEC", 0.2)
+    monkeypatch.setattr(alerts, "ALERT_RETRY_BASE_SEC", 0.01)
+    monkeypatch.setattr(alerts, "ALERT_DIGEST_SEC", 0)
+    policy = {"name": "PARSE_FAIL_RATE", "severity": "WARN", "cooldown_sec": 60}
+    context = {"file_path": f"outbox-{uuid4().hex}", "device": None, "summary": "test"}
+    try:
+        started = time.perf_counter()
+        alerts.dispatch_alert(policy, context)
+        alerts.dispatch_alert(policy, context)
+        assert time.perf_counter() - started < 0.1
+        deadline = time.time() + 5
+        while time.time() < deadline and not alerts.dispatch_pending(timeout=0.2):
+            pass
+    finally:
+        server.shutdown()
+        server.server_close()
+    flush_writes()
+    with read_cursor() as cur:
+        cur.execute("SELECT status FROM alerts WHERE dedup_key = ?", (f"PARSE_FAIL_RATE:{context['file_path']}",))
+        statuses = [row["status"] for row in cur.fetchall()]
+    assert hits == ["429", "timeout", "200"]
+    assert statuses == ["SENT"]
+
+
+def test_digest_groups_alerts_per_severity(monkeypatch):
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from uuid import uuid4
+
+    from app import alerts, notify
+    from app.db import flush_writes, init_db, read_cursor
+
+    received = []
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            received.append((self.client_address, body["text"]))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    init_db()
+    monkeypatch.setattr(notify, "WEBHOOK_URL", f"http://127.0.0.1:{server.server_port}/hook")
+    monkeypatch.setattr(notify, "WEBHOOK_DISABLE", False)
+    monkeypatch.setattr(alerts, "ALERT_DIGEST_SEC", 0.2)
+    monkeypatch.setattr(alerts, "ALERT_DIGEST_SAMPLES", 2)
+    tag = uuid4().hex
+    stall = {"name": "INGEST_STALL", "severity": "WARN", "cooldown_sec": 60}
+    missing = {"name": "FILE_MISSING", "severity": "CRITICAL", "cooldown_sec": 60}
+    for n in range(3):
+        alerts.dispatch_alert(stall, {"file_path": f"{tag}-{n}", "summary": "ingest stalled"})
+    alerts.dispatch_alert(missing, {"file_path": f"{tag}-x", "summary": "file missing"})
+    try:
+        deadline = time.time() + 5
+        sent = 0
+        while time.time() < deadline and sent < 4:
+            sent += alerts.dispatch_pending(timeout=0.5)
+    finally:
+        notify._close()
+        server.shutdown()
+        server.server_close()
+    flush_writes()
+    with read_cursor() as cur:
+        cur.execute("SELECT status FROM alerts WHERE dedup_key LIKE ?", (f"%{tag}%",))
+        statuses = [row["status"] for row in cur.fetchall()]
+    texts = sorted(text for _, text in received)
+    assert len(received) == 2
+    assert received[0][0] == received[1][0]
+    assert "[WARN] 3 alerts" in texts[1] and "+1" in texts[1]
+    assert "[CRITICAL] FILE_MISSING" in texts[0]
+    assert statuses == ["SENT"] * 4
+
+
+def test_parse_fail_rate_skips_windows_beyond_ring(monkeypatch):
+    from app import alerts, counters
+
+    sent = []
+    monkeypatch.setattr(alerts, "dispatch_alert", lambda policy, context: sent.append(context))
+    alerts._check_parse_fail_rate({"name": "PARSE_FAIL_RATE"}, {"rate": 0.0}, counters.WINDOW_MAX_SEC + 1)
+    assert sent == []
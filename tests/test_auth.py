@@ -0,0 +1,23 @@
+import base64
+
+import pytest
+from fastapi import HTTPException
+
+from app import auth
+
+
+class FakeRequest:
+    def __init__(self, user, password):
+        token = base64.b64encode(f"{user}:{password}".encode()).decode()
+        self.headers = {"Authorization": f"Basic {token}"}
+
+
+def test_roles_and_cache(monkeypatch):
+    assert auth.require_viewer(FakeRequest(auth.VIEWER_USER, auth.VIEWER_PASS)) == "VIEWER"
+    assert auth.require_admin(FakeRequest(auth.ADMIN_USER, auth.ADMIN_PASS)) == "ADMIN"
+    monkeypatch.setattr(auth, "_check", lambda username, password: None)
+    assert auth.require_viewer(FakeRequest(auth.VIEWER_USER, auth.VIEWER_PASS)) == "VIEWER"
+    with pytest.raises(HTTPException):
+        auth.require_admin(FakeRequest(auth.VIEWER_USER, auth.VIEWER_PASS))
+    with pytest.raises(HTTPException):
+        auth.require_viewer(FakeRequest("nobody", "wrong"))
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+from app import broadcast
+
+
+def _read(last_event_id, filters=None, projection=None):
+    async def first_chunk():
+        stream = broadcast.aiter_events(str(last_event_id), None, filters, projection)
+        try:
+            return await asyncio.wait_for(stream.__anext__(), 2)
+        finally:
+            await stream.aclose()
+
+    chunk = asyncio.run(first_chunk())
+    events = []
+    for frame in chunk.split("\n\n"):
+        if not frame:
+            continue
+        fields = dict(line.split(": ", 1) for line in frame.split("\n"))
+        events.append((fields.get("event", "message"), fields.get("id"), json.loads(fields["data"])))
+    return chunk, events
+
+
+def test_every_subscriber_gets_every_event():
+    start = broadcast._next_id - 1
+    broadcast.publish_event({"seq": 1})
+    broadcast.publish_event({"seq": 2})
+    for _ in range(2):
+        _, events = _read(start)
+        assert [data["seq"] for _, _, data in events] == [1, 2]
+
+
+def test_resume_from_last_event_id_and_lag(monkeypatch):
+    start = broadcast._next_id - 1
+    for seq in range(5):
+        broadcast.publish_event({"seq": seq})
+    _, events = _read(start + 3)
+    assert [data["seq"] for _, _, data in events] == [3, 4]
+    assert events[0][1] == str(start + 4)
+
+    monkeypatch.setattr(broadcast, "_buffer", broadcast.deque(broadcast._buffer, maxlen=2))
+    _, events = _read(start)
+    assert events[0] == ("lagged", None, {"missed": 3})
+    assert [data["seq"] for _, _, data in events[1:]] == [3, 4]
+
+
+def test_async_stream_wakes_on_publish_from_thread():
+    import threading
+
+    async def consume():
+        stream = broadcast.aiter_events()
+        first = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        threading.Thread(target=broadcast.publish_event, args=({"seq": "async"},)).start()
+        chunk = await asyncio.wait_for(first, 2)
+        await stream.aclose()
+        return chunk
+
+    chunk = asyncio.run(consume())
+    assert '"seq": "async"' in chunk
+    assert not broadcast._loop_events
+
+
+def test_filtered_subscriber_and_shared_projection():
+    filters, projection = broadcast.build_view({"device": "DEV_A", "raw": "0"})
+    assert filters == {"device": "DEV_A"}
+    start = broadcast._next_id - 1
+    broadcast.publish_event({"device": "DEV_B", "raw_line": "b"})
+    broadcast.publish_event({"device": "DEV_A", "raw_line": "a", "grp": 1})
+    chunk, events = _read(start, filters, projection)
+    assert [data for _, _, data in events] == [{"device": "DEV_A", "grp": 1}]
+    assert broadcast._buffer[-1][2][projection] == chunk
+
+
+def test_concurrent_subscribers_share_one_loop():
+    import threading
+
+    async def consume(stream):
+        return await asyncio.wait_for(stream.__anext__(), 2)
+
+    async def fan_out():
+        streams = [broadcast.aiter_events(), broadcast.aiter_events()]
+        pending = [asyncio.ensure_future(consume(stream)) for stream in streams]
+        await asyncio.sleep(0.01)
+        threading.Thread(target=broadcast.publish_event, args=({"seq": "fan"},)).start()
+        chunks = await asyncio.gather(*pending)
+        for stream in streams:
+            await stream.aclose()
+        return chunks
+
+    chunks = asyncio.run(fan_out())
+    assert all('"seq": "fan"' in chunk for chunk in chunks)
+    assert not broadcast._loop_events
+
+
+def test_stream_stops_after_batch_when_disconnected():
+    async def gone():
+        return True
+
+    async def drain():
+        start = broadcast._next_id - 1
+        broadcast.publish_event({"seq": "last"})
+        return [chunk async for chunk in broadcast.aiter_events(str(start), gone)]
+
+    chunks = asyncio.run(drain())
+    assert len(chunks) == 1 and '"seq": "last"' in chunks[0]
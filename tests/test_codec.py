@@ -0,0 +1,29 @@
+from app.codec import pack_values, unpack_values
+
+
+def test_pack_values_round_trip():
+    for values in ([], [100, 200, -1, 419], [1.2, 3.4, 5.6], [1, 2.5, -3], [0.1 + 0.2, 7], [2**40, 1]):
+        packed = pack_values(values)
+        assert isinstance(packed, bytes)
+        decoded = unpack_values(packed)
+        assert decoded == values
+        assert [type(v) for v in decoded] == [type(v) for v in values]
+    assert unpack_values("[1, 2.5]") == [1, 2.5]
+    assert unpack_values(pack_values([2**70])) == [2**70]
+
+
+def test_pack_values_keeps_large_ints_with_floats():
+    import random
+
+    from app.parse import parse_line
+
+    cases = [[2**60 + 1, 1.5], [1700000000123456789, 0.1234567], [-(2**53) - 1, 1e-9, 3]]
+    rng = random.Random(7)
+    for _ in range(500):
+        cases.append([rng.choice((rng.randint(-(2**63), 2**63), rng.random() * 10**rng.randint(0, 9))) for _ in range(4)])
+    for values in cases:
+        decoded = unpack_values(pack_values(values))
+        assert decoded == values
+        assert [type(v) for v in decoded] == [type(v) for v in values]
+    parsed = parse_line("DEV;1;2;1700000000123456789;0.1234567", {"file_path": "f"})
+    assert unpack_values(pack_values(parsed["values"])) == parsed["values"]
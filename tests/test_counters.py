@@ -0,0 +1,39 @@
+from app.counters import RingCounter
+
+
+def test_ring_window_expires():
+    counter = RingCounter(10)
+    counter.add(5, 1, 100.0)
+    counter.add(3, 0, 105.5)
+    assert counter.window(10, 105.9) == (8, 1)
+    assert counter.window(3, 105.9) == (3, 0)
+    assert counter.window(10, 112.0) == (3, 0)
+    counter.add(2, 2, 110.0)
+    assert counter.window(10, 110.0) == (5, 2)
+
+
+def test_idle_and_excess_keys_are_evicted(monkeypatch):
+    from app import counters
+
+    monkeypatch.setattr(counters, "_counters", counters.OrderedDict())
+    monkeypatch.setattr(counters, "COUNTER_MAX_KEYS", 5)
+    counters.record_events("old", [{"device": "OLD", "parse_ok": 1}], now=1000.0)
+    now = 1000.0 + counters.WINDOW_MAX_SEC + 1
+    for n in range(4):
+        counters.record_events("new", [{"device": f"D{n}", "parse_ok": 1}], now=now)
+    keys = set(counters._counters)
+    assert ("file", "old") not in keys and ("device", "OLD") not in keys
+    assert len(keys) == 5 and ("all", "all") in keys and ("device", "D3") in keys
+
+
+def test_set_window_resizes_rings_and_keeps_counts(monkeypatch):
+    from app import counters
+
+    monkeypatch.setattr(counters, "_counters", counters.OrderedDict())
+    monkeypatch.setattr(counters, "_ring_size", counters.RATE_WINDOW_SEC)
+    counters.record_events("f", [{"device": "D", "parse_ok": 0}] * 4, now=1000.0)
+    counters.set_window(300)
+    counters.record_events("f", [{"device": "D", "parse_ok": 1}] * 2, now=1200.0)
+    assert len(counters._counters[("file", "f")].totals) == 300
+    assert counters.window_counts("file", 300, 1200.0)["f"] == (6, 4)
+    assert counters.lines_per_sec("file", 300, 1200.0)["f"] == 0.02
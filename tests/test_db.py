@@ -1,5 +1,191 @@
-from app.db import init_db
+import uuid
+
+from app.db import init_db, insert_events, query_events
 
 
 def test_init_db():
     init_db()
+
+
+def test_query_events_filters_and_keyset():
+    init_db()
+    path = "test_query_events.log"
+    device = f"DEV_{uuid.uuid4().hex[:8]}"
+    payloads = [
+        {"file_path": path, "device": device, "grp": seq % 2, "seq": seq, "parse_ok": 1, "record_type": "DATA"}
+        for seq in range(5)
+    ]
+    insert_events(payloads, path, 0, "1")
+    first = query_events({"device": device, "grp": 0}, ["seq"], limit=2)
+    assert [row["seq"] for row in first] == [4, 2]
+    assert set(first[0]) == {"id", "seq"}
+    rest = query_events({"device": device, "grp": 0}, ["seq"], before_id=first[-1]["id"], limit=2)
+    assert [row["seq"] for row in rest] == [0]
+
+
+def test_migrate_adds_and_backfills_created_ts():
+    import sqlite3
+
+    from app.db import _migrate
+
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    for table in ("events", "alerts", "audit_log"):
+        cur.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, created_at TEXT)")
+        cur.execute(f"INSERT INTO {table} (created_at) VALUES ('2021-01-17 00:00:00')")
+    _migrate(cur)
+    cur.execute("SELECT created_ts FROM events")
+    assert cur.fetchone()["created_ts"] == 1610841600
+
+
+def test_prune_old_records_in_batches():
+    from app.db import db_cursor, prune_old_records
+
+    init_db()
+    with db_cursor() as cur:
+        cur.executemany(
+            "INSERT INTO audit_log (created_ts, actor, action, detail) VALUES (0, 'test', 'OLD', ?)",
+            [(str(i),) for i in range(5)],
+        )
+    stats = prune_old_records(batch_size=2)
+    assert stats["removed"]["audit_log"] >= 5
+    with db_cursor() as cur:
+        cur.execute("SELECT COUNT(*) AS n FROM audit_log WHERE created_ts < ?", (stats["cutoff"],))
+        assert cur.fetchone()["n"] == 0
+
+
+def test_partitioned_events_fan_out_and_drop(tmp_path, monkeypatch):
+    import os
+    import time
+
+    from app import db
+
+    init_db()
+    monkeypatch.setattr(db, "EVENT_PARTITION_HOURS", 24)
+    monkeypatch.setattr(db, "EVENT_PARTITION_DIR", str(tmp_path))
+    monkeypatch.setattr(db, "_partitions", None)
+    monkeypatch.setattr(db, "_next_event_id", None)
+    real_time = time.time
+    device = f"DEV_{uuid.uuid4().hex[:8]}"
+    try:
+        monkeypatch.setattr(time, "time", lambda: real_time() - 40 * 86400)
+        insert_events([{"file_path": "p.log", "device": device, "seq": 1}], "p.log", 10, "1")
+        monkeypatch.setattr(time, "time", real_time)
+        insert_events([{"file_path": "p.log", "device": device, "seq": 2}], "p.log", 20, "1")
+        assert len(os.listdir(tmp_path)) >= 2
+        rows = query_events({"device": device}, ["seq"])
+        assert [row["seq"] for row in rows] == [2, 1]
+        assert rows[0]["id"] > rows[1]["id"]
+        assert query_events({"device": device, "since": int(real_time()) - 3600}, ["seq"])[0]["seq"] == 2
+        real_remove = os.remove
+
+        def locked(path):
+            raise PermissionError(path)
+
+        monkeypatch.setattr(os, "remove", locked)
+        assert db.prune_old_records()["removed"]["partitions"] == 0
+        assert [row["seq"] for row in query_events({"device": device}, ["seq"])] == [2]
+        monkeypatch.setattr(os, "remove", real_remove)
+        stats = db.prune_old_records()
+        assert stats["removed"]["partitions"] == 1
+        assert [row["seq"] for row in query_events({"device": device}, ["seq"])] == [2]
+    finally:
+        with db.db_cursor() as cur:
+            for conn in [cur.connection, *db._read_idle]:
+                for key in list(db._list_partitions()):
+                    db._detach(conn, key)
+
+
+def test_packed_values_read_back_through_query(monkeypatch):
+    from app import db
+
+    init_db()
+    monkeypatch.setattr(db, "VALUE_ENCODING", "packed")
+    device = f"DEV_{uuid.uuid4().hex[:8]}"
+    insert_events([{"file_path": "v.log", "device": device, "values": [1, 2.5], "rule_applied_ids": [3]}], "v.log", 1, "1")
+    monkeypatch.setattr(db, "VALUE_ENCODING", "json")
+    insert_events([{"file_path": "v.log", "device": device, "values": [4]}], "v.log", 2, "1")
+    rows = query_events({"device": device}, ["values", "rule_applied_ids"])
+    assert [row["values"] for row in rows] == [[4], [1, 2.5]]
+    assert rows[1]["rule_applied_ids"] == [3]
+
+
+def test_reads_do_not_wait_for_writer():
+    import threading
+
+    from app import db
+
+    init_db()
+    result = []
+    with db._db_lock:
+        reader = threading.Thread(target=lambda: result.append(db.list_file_states()))
+        reader.start()
+        reader.join(timeout=5)
+    assert result
+    assert db.get_db_stats()["read_pool"]["open"] >= 1
+
+
+def test_group_commit_isolates_failed_ops():
+    import pytest
+
+    from app import db
+
+    init_db()
+    device = f"DEV_{uuid.uuid4().hex[:8]}"
+
+    def fail(cur):
+        cur.execute("INSERT INTO events (device) VALUES (?)", (device,))
+        raise ValueError("boom")
+
+    batches = db.get_write_stats()["batches"]
+    futures = [db.submit_write(db._write_events, [{"device": device, "seq": seq}]) for seq in range(3)]
+    failed = db.submit_write(fail)
+    futures.append(db.submit_write(db._write_events, [{"device": device, "seq": 3}]))
+    for future in futures:
+        future.result(timeout=5)
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+    assert [row["seq"] for row in query_events({"device": device}, ["seq"])] == [3, 2, 1, 0]
+    stats = db.get_write_stats()
+    assert stats["batches"] - batches < 5
+    assert sum(stats["commit_ms"].values()) == stats["batches"]
+
+
+def test_audit_collapses_login_success():
+    from app.db import flush_audit, flush_writes, read_cursor, record_audit
+
+    init_db()
+    actor = f"user_{uuid.uuid4().hex[:8]}"
+    for _ in range(5):
+        record_audit(actor, "LOGIN_SUCCESS", "viewer")
+    record_audit(actor, "RULE_DELETE", "{}")
+    flush_audit(force=True)
+    flush_writes()
+    with read_cursor() as cur:
+        cur.execute("SELECT action, count FROM audit_log WHERE actor = ? ORDER BY action", (actor,))
+        rows = [tuple(row) for row in cur.fetchall()]
+    assert rows == [("LOGIN_SUCCESS", 5), ("RULE_DELETE", 1)]
+
+
+def test_since_until_use_id_bounds(monkeypatch):
+    import time
+
+    from app import db
+
+    init_db()
+    device = f"DEV_{uuid.uuid4().hex[:8]}"
+    base = int(time.time()) + 1000
+    for seq in range(3):
+        monkeypatch.setattr(time, "time", lambda seq=seq: base + seq * 10)
+        insert_events([{"file_path": "t.log", "device": device, "seq": seq}], "t.log", seq, "1")
+    monkeypatch.undo()
+    rows = query_events({"device": device, "since": base + 5, "until": base + 20}, ["seq"])
+    assert [row["seq"] for row in rows] == [1]
+    assert query_events({"device": device, "since": base + 30}, ["seq"]) == []
+    with db.read_cursor() as cur:
+        plan = cur.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM events WHERE device = ? AND parse_ok = ? AND id < ? ORDER BY id DESC",
+            (device, 0, 10),
+        ).fetchall()
+    assert "idx_events_device_parse_ok_id" in plan[0][-1]
@@ -0,0 +1,138 @@
+from app import ingest
+from app.db import db_cursor, init_db, list_file_states
+
+
+def test_ingest_once_batches_and_saves_offset(tmp_path, monkeypatch):
+    init_db()
+    log = tmp_path / "teraterm-test"
+    log.write_bytes(b"DEV_A;1;10;1;2;3\nDEV_A;2;10;4;5;6\nDEV_A;3;10;7;8;9\n")
+    monkeypatch.setattr(ingest, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(ingest, "INCLUDE_GLOBS", "teraterm-*")
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 2)
+    ingest.ingest_once()
+    path = str(log)
+    assert list_file_states()[path]["offset"] == log.stat().st_size
+    with db_cursor() as cur:
+        cur.execute("SELECT COUNT(*) AS n FROM events WHERE file_path = ?", (path,))
+        assert cur.fetchone()["n"] == 3
+
+
+def test_partial_line_is_carried_to_next_poll(tmp_path, monkeypatch):
+    init_db()
+    log = tmp_path / "teraterm-partial"
+    log.write_bytes(b"DEV_B;1;10;1;2\r\nDEV_B;2;1")
+    monkeypatch.setattr(ingest, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(ingest, "INCLUDE_GLOBS", "teraterm-*")
+    monkeypatch.setattr(ingest, "READ_BLOCK_SIZE", 4)
+    path = str(log)
+    ingest.ingest_once()
+    assert list_file_states()[path]["offset"] == len(b"DEV_B;1;10;1;2\r\n")
+    with log.open("ab") as handle:
+        handle.write(b"0;3;4\n")
+    ingest.ingest_once()
+    assert list_file_states()[path]["offset"] == log.stat().st_size
+    with db_cursor() as cur:
+        cur.execute("SELECT raw_line FROM events WHERE file_path = ? ORDER BY id", (path,))
+        assert [row["raw_line"] for row in cur.fetchall()] == ["DEV_B;1;10;1;2", "DEV_B;2;10;3;4"]
+
+
+def test_parallel_workers_keep_per_file_order(tmp_path, monkeypatch):
+    init_db()
+    for name in ("a", "b", "c"):
+        lines = "".join(f"DEV_{name};{seq};1;{seq}\n" for seq in range(50))
+        (tmp_path / f"teraterm-{name}").write_text(lines)
+    monkeypatch.setattr(ingest, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(ingest, "INCLUDE_GLOBS", "teraterm-*")
+    monkeypatch.setattr(ingest, "INGEST_WORKERS", 3)
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 7)
+    ingest.ingest_once()
+    for name in ("a", "b", "c"):
+        path = str(tmp_path / f"teraterm-{name}")
+        assert ingest.get_status_snapshot()[path]["status"] == "ok"
+        with db_cursor() as cur:
+            cur.execute("SELECT seq FROM events WHERE file_path = ? ORDER BY id", (path,))
+            assert [row["seq"] for row in cur.fetchall()] == list(range(50))
+
+
+def test_pools_created_once(monkeypatch):
+    import threading
+
+    from app import ingest
+
+    monkeypatch.setattr(ingest, "INGEST_WORKERS", 4)
+    monkeypatch.setattr(ingest, "INGEST_PARSE_PROCESSES", 1)
+    threads = [threading.Thread(target=ingest._start_pools) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pools = (ingest._worker_pool, ingest._parse_pool)
+    ingest._start_pools()
+    assert (ingest._worker_pool, ingest._parse_pool) == pools and None not in pools
+    ingest._stop_pools()
+    assert ingest._worker_pool is None and ingest._parse_pool is None
+
+
+def test_iter_lines_stops_at_stat_size(tmp_path):
+    from app.ingest import _iter_lines
+
+    path = tmp_path / "log"
+    path.write_bytes(b"DEV;1;1;1\nDEV;2;1;2\nDEV;3;1")
+    size = len(b"DEV;1;1;1\nDEV;2;1;2\n")
+    lines = list(_iter_lines(str(path), 0, final=True, stop=size))
+    assert lines == [("DEV;1;1;1", 10), ("DEV;2;1;2", size)]
+    assert list(_iter_lines(str(path), 0, final=True, stop=size + 7))[-1] == ("DEV;3;1", size + 7)
+
+
+def test_failed_paths_are_retried_without_changes(monkeypatch):
+    import threading
+
+    stop_event = threading.Event()
+    seen = []
+
+    class Watcher:
+        def poll(self, timeout):
+            stop_event.set()
+            return set()
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(ingest, "create_watcher", lambda *args: Watcher())
+    monkeypatch.setattr(ingest, "_failed_paths", {"broken.log": "disk I/O error"})
+    monkeypatch.setattr(ingest, "ingest_once", seen.append)
+    ingest.start_ingest_loop(stop_event)
+    assert seen == [["broken.log"]]
+
+
+def test_parse_pool_uses_spawned_workers(tmp_path, monkeypatch):
+    init_db()
+    log = tmp_path / "teraterm-pool"
+    log.write_bytes(b"DEV_P;1;10;1;2\nDEV_P;2;10;3;4\n")
+    monkeypatch.setattr(ingest, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(ingest, "INCLUDE_GLOBS", "teraterm-pool")
+    monkeypatch.setattr(ingest, "INGEST_PARSE_PROCESSES", 1)
+    try:
+        ingest.ingest_once()
+        assert ingest._parse_pool._mp_context.get_start_method() == "spawn"
+    finally:
+        ingest._stop_pools()
+    with db_cursor() as cur:
+        cur.execute("SELECT raw_line FROM events WHERE file_path = ? ORDER BY id", (str(log),))
+        assert [row["raw_line"] for row in cur.fetchall()] == ["DEV_P;1;10;1;2", "DEV_P;2;10;3;4"]
+
+
+def test_serial_flush_error_marks_file(tmp_path, monkeypatch):
+    log = tmp_path / "teraterm-fail"
+    log.write_bytes(b"DEV_F;1;10;1\n")
+    monkeypatch.setattr(ingest, "INGEST_WORKERS", 1)
+
+    def broken(*args):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(ingest, "_flush", broken)
+    ingest.ingest_once([str(log)])
+    status = ingest.get_status_snapshot()[str(log)]
+    assert status["status"] == "db_error" and status["error"] == "database is locked"
+    assert str(log) in ingest._failed_paths
+    ingest._failed_paths.clear()
@@ -0,0 +1,24 @@
+from app import metrics
+
+
+def test_render_counters_and_histograms():
+    from app import broadcast, db  # noqa: F401
+
+    metrics.inc("test_requests_total", 2, file='a"b')
+    metrics.observe("test_stage_seconds", 0.003, stage="parse")
+    metrics.observe("test_stage_seconds", 9.0, stage="parse")
+    text = metrics.render()
+    assert "# TYPE logtail_test_requests_total counter" in text
+    assert 'logtail_test_requests_total{file="a\\"b"} 2' in text
+    assert 'logtail_test_stage_seconds_bucket{stage="parse",le="0.005"} 1' in text
+    assert 'logtail_test_stage_seconds_bucket{stage="parse",le="+Inf"} 2' in text
+    assert 'logtail_test_stage_seconds_count{stage="parse"} 2' in text
+    assert "logtail_db_commit_seconds_bucket" in text
+    assert "logtail_stream_dropped_events_total" in text
+
+
+def test_timing_switch(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TIMING", False)
+    started = metrics.start_timer()
+    metrics.observe_since("test_disabled_seconds", started)
+    assert "test_disabled_seconds" not in metrics.render()
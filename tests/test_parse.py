@@ -24,3 +24,42 @@ def test_parse_space():
     line = "noiseDEV_C 3 4 1 2"
     parsed = parse_line(line, context)
     assert parsed["device"] == "noiseDEV_C"
+
+
+def test_parse_lines_matches_parse_line():
+    from app.parse import iter_parsed, parse_lines
+
+    lines = [
+        "DEV_A;1;2;3;4;-1; 419",
+        "DEV_B\t2\t3\t9.5\t8\t-0.0",
+        "noiseDEV_C 3 4 1 2",
+        "DEV_D;4;5;1.25;2.5",
+        "DEV_E;5;6",
+        "# comment",
+        "HEADER x",
+        "   ",
+        "DEV;1",
+        "DEV;x;1;2",
+        "DEV_F;6;7;1-2;a3b4.5",
+    ]
+    for context in ({}, {"drop_indexes": [0]}, {"coerce_numeric": True}, {"valuecount_range": (2, 3)}):
+        columns = parse_lines(lines, dict(context))
+        expected = [parse_line(line, dict(context)) for line in lines]
+        rows = list(iter_parsed(columns))
+        assert rows == expected
+        assert [type(row.get("value_avg")) for row in rows] == [type(row.get("value_avg")) for row in expected]
+    columns = parse_lines(lines[:2], {})
+    assert columns["offsets"] == [0, 4, 7]
+    assert columns["values"][4:] == [9.5, 8, -0.0]
+
+
+def test_parse_lines_numpy_stats_match(monkeypatch):
+    import pytest
+
+    pytest.importorskip("numpy")
+    from app import parse
+
+    monkeypatch.setattr(parse, "PARSE_NUMPY_MIN_BATCH", 0)
+    lines = ["DEV_A;1;2;3;4;-1", "DEV_B;2;3;9.5;-0.0", "DEV_C;3;4;1.5;2", "DEV_D;4;5", f"DEV_E;5;6;{2**60};1"]
+    rows = list(parse.iter_parsed(parse.parse_lines(lines, {})))
+    assert rows == [parse_line(line, {}) for line in lines]
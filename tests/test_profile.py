@@ -5,3 +5,74 @@ def test_suggest_labels():
     labels = suggest_labels("DEV", 1, 3)
     assert labels[0]["label"] == "flag_0"
     assert labels[1]["label"] == "v1"
+
+
+def test_running_stats_merge_matches_single_pass():
+    import math
+
+    from app.profile import RunningStats
+
+    values = [3, -1, 4.5, 1, 5, 9, 2, 6, 5, 3]
+    whole = RunningStats()
+    left = RunningStats()
+    right = RunningStats()
+    for pos, value in enumerate(values):
+        whole.add(value)
+        (left if pos < 4 else right).add(value)
+    left.merge(right)
+    mean = sum(values) / len(values)
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / len(values))
+    assert left.count == whole.count == len(values)
+    assert math.isclose(left.mean, mean) and math.isclose(left.std(), std)
+    assert (left.min, left.max, left.negative) == (-1, 9, 1)
+    assert left.unique_count() == whole.unique_count() == len(set(values))
+
+
+def test_unique_count_sketch_stays_bounded(monkeypatch):
+    from app import profile
+
+    stats = profile.RunningStats()
+    for value in range(20000):
+        stats.add(value)
+    assert len(stats.sketch) == profile.PROFILE_SKETCH_SIZE
+    assert 10000 < stats.unique_count() < 40000
+
+
+def test_profile_state_merges_across_flushes():
+    import uuid
+
+    from app.db import flush_writes, init_db, read_cursor
+    from app.profile import _flush_profile, update_profile
+
+    init_db()
+    device = f"DEV_{uuid.uuid4().hex[:8]}"
+    for values in ([0, 10], [1, 20], [0, 30]):
+        update_profile(device, 1, values)
+        _flush_profile(device, 1)
+    flush_writes(timeout=5)
+    with read_cursor() as cur:
+        cur.execute("SELECT * FROM value_profile_index WHERE device = ? ORDER BY idx", (device,))
+        rows = cur.fetchall()
+    assert [row["sample_count"] for row in rows] == [3, 3]
+    assert rows[0]["is_binary"] == 1 and rows[0]["unique_count"] == 2
+    assert (rows[1]["min"], rows[1]["max"], rows[1]["avg"]) == (10, 30, 20)
+
+
+def test_profile_buffer_evicts_by_flushing(monkeypatch):
+    from app import profile
+
+    written = []
+    monkeypatch.setattr(profile, "submit_write", lambda op, device, grp, state: written.append((device, grp)))
+    monkeypatch.setattr(profile, "_profile_cache", profile.OrderedDict())
+    monkeypatch.setattr(profile, "_buffer_stats", {"samples": 0, "bytes": 0, "flushes": 0, "evictions": 0})
+    monkeypatch.setattr(profile, "PROFILE_BUFFER_MAX_BYTES", 3 * (profile.STATE_BYTES + profile.INDEX_BYTES))
+    for grp in range(5):
+        profile.update_profile("DEV", grp, [1])
+    profile.update_profile("DEV", 2, [1])
+    stats = profile.get_profile_stats()
+    assert written == [("DEV", 0), ("DEV", 1)]
+    assert stats["keys"] == 3 and stats["buffered_samples"] == 4 and stats["evictions"] == 2
+    assert profile.flush_profiles(max_age=3600) == 0
+    assert profile.flush_profiles() == 3
+    assert written[2:] == [("DEV", 3), ("DEV", 4), ("DEV", 2)]
+    assert profile.get_profile_stats()["memory_bytes"] == 0
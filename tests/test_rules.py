@@ -1,3 +1,6 @@
+import time
+
+from app import rules
 from app.rules import apply_rules
 
 
@@ -10,3 +13,64 @@ def test_ignore_rule():
     assert line2 == line
     assert meta == {}
     assert applied == []
+
+
+def _rule(rule_id, rule_type, pattern=None, action_json=None, scope_type="GLOBAL", scope_value=None):
+    return {
+        "id": rule_id,
+        "rule_type": rule_type,
+        "pattern": pattern,
+        "action_json": action_json,
+        "scope_type": scope_type,
+        "scope_value": scope_value,
+    }
+
+
+def _use_plan(monkeypatch, rows):
+    monkeypatch.setattr(rules, "_plan", rules._build_plan(rows))
+    monkeypatch.setattr(rules, "_last_load", time.time())
+
+
+def test_compiled_plan_scopes(monkeypatch):
+    _use_plan(
+        monkeypatch,
+        [
+            _rule(1, "LINE_REPLACE_REGEX", "^noise", '{"replace": ""}', "FILE", "a.log"),
+            _rule(2, "IGNORE_LINE_REGEX", "^#"),
+            _rule(3, "COERCE_NUMERIC", scope_type="DEVICE", scope_value="DEV_A"),
+            _rule(4, "IGNORE_LINE_REGEX", "(", scope_type="GLOBAL"),
+        ],
+    )
+    assert apply_rules("noiseDEV;1;2", {"file_path": "a.log"}) == ("DEV;1;2", {}, [1])
+    assert apply_rules("noiseDEV;1;2", {"file_path": "b.log"}) == ("noiseDEV;1;2", {}, [])
+    context = {"file_path": "b.log", "device": "DEV_A"}
+    assert apply_rules("DEV_A;1;2", context)[2] == [3]
+    assert context["coerce_numeric"] is True
+    assert apply_rules("# note", {"file_path": "a.log"}) == ("# note", {"record_type": "IGNORE", "parse_ok": 1}, [2])
+
+
+def test_match_rules_keep_priority_order(monkeypatch):
+    _use_plan(
+        monkeypatch,
+        [
+            _rule(1, "IGNORE_LINE_REGEX", "zzz"),
+            _rule(2, "FORCE_HEADER_REGEX", "^DEV"),
+            _rule(3, "LINE_REPLACE_REGEX", "^X", '{"replace": "#"}'),
+            _rule(4, "IGNORE_LINE_REGEX", "^#"),
+            _rule(5, "FORCE_HEADER_REGEX", r"(?P<tag>H)(?P=tag)"),
+        ],
+    )
+    steps = rules._plan.global_steps
+    assert type(steps[0]) is rules.MatchGroup and [r.id for r in steps[0].rules] == [1, 2]
+    assert apply_rules("DEV zzz", {})[1:] == ({"record_type": "IGNORE", "parse_ok": 1}, [1])
+    assert apply_rules("DEV 1 2", {})[1:] == ({"record_type": "HEADER", "parse_ok": 1}, [2])
+    assert apply_rules("Xabc", {}) == ("#abc", {"record_type": "IGNORE", "parse_ok": 1}, [3, 4])
+    assert apply_rules("HH", {})[2] == [5]
+    assert apply_rules("plain", {}) == ("plain", {}, [])
+
+
+def test_invalid_pattern_is_logged(caplog):
+    with caplog.at_level("WARNING", logger="app.rules"):
+        compiled = rules._compile_rule(0, _rule(9001, "IGNORE_LINE_REGEX", "(unclosed"))
+    assert compiled.regex is None
+    assert "rule 9001 skipped" in caplog.text
@@ -0,0 +1,56 @@
+import json
+import uuid
+
+import pytest
+
+from app.db import flush_writes, init_db, read_cursor
+from app.transfer import import_config, iter_export
+
+
+def test_import_rejects_whole_payload():
+    init_db()
+    device = f"DEV_{uuid.uuid4().hex[:8]}"
+    payload = {
+        "labels": [{"device": device, "grp": 0, "idx": 0, "label": "temp"}],
+        "rules": [{"rule_type": "IGNORE_LINE_REGEX", "pattern": "(unclosed"}],
+    }
+    with pytest.raises(ValueError, match=r"rules\[0\]"):
+        import_config(payload)
+    with read_cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM value_labels WHERE device = ?", (device,))
+        assert cur.fetchone()[0] == 0
+
+
+def test_export_round_trips_profiles():
+    init_db()
+    device = f"DEV_{uuid.uuid4().hex[:8]}"
+    summary = import_config(
+        {
+            "value_profile": [{"device": device, "grp": 1, "typical_value_count": 3}],
+            "value_profile_index": [{"device": device, "grp": 1, "idx": 0, "avg": 1.5, "sketch": "AAECAwQFBgc="}],
+        }
+    )
+    assert summary["value_profile_index"] == 1
+    flush_writes()
+    exported = json.loads("".join(iter_export(include_profiles=True)))
+    assert set(exported) == {"rules", "labels", "value_profile", "value_profile_index"}
+    rows = [row for row in exported["value_profile_index"] if row["device"] == device]
+    assert rows[0]["sketch"] == "AAECAwQFBgc="
+    assert "value_profile" not in json.loads("".join(iter_export()))
+
+
+def test_import_requires_full_profile_state():
+    init_db()
+    row = {"device": "D", "grp": 1, "idx": 0, "sample_count": 5, "avg": 1.0}
+    with pytest.raises(ValueError, match="m2"):
+        import_config({"value_profile_index": [row]})
+
+
+def test_import_rejects_bad_profile_types():
+    init_db()
+    row = {"device": "D", "grp": 1, "idx": 0, "sample_count": 5}
+    row.update({"avg": 1.0, "m2": 0.0, "min": 1, "max": 1, "negative_count": 0})
+    with pytest.raises(ValueError, match="sketch"):
+        import_config({"value_profile_index": [{**row, "sketch": "AAEC"}]})
+    with pytest.raises(ValueError, match="m2"):
+        import_config({"value_profile_index": [{**row, "m2": "x"}]})
@@ -0,0 +1,38 @@
+import sys
+import time
+
+import pytest
+
+from app import watch
+
+
+def test_stat_watcher_reports_only_changed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch, "WATCH_POLL_SEC", 0)
+    a = tmp_path / "a.log"
+    b = tmp_path / "b.log"
+    a.write_text("1\n")
+    b.write_text("1\n")
+    watcher = watch.StatWatcher(lambda: [str(a), str(b)])
+    assert watcher.poll(0) == {str(a), str(b)}
+    assert watcher.poll(0) == set()
+    with a.open("a") as handle:
+        handle.write("2\n")
+    assert watcher.poll(0) == {str(a)}
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_inotify_watcher_wakes_on_append(tmp_path):
+    log = tmp_path / "teraterm-1"
+    log.write_text("1\n")
+    (tmp_path / "other.txt").write_text("x\n")
+    watcher = watch.InotifyWatcher(str(tmp_path), ["teraterm-*"], lambda: [str(log)])
+    try:
+        assert watcher.poll(0) == {str(log)}
+        with log.open("a") as handle:
+            handle.write("2\n")
+        (tmp_path / "other.txt").write_text("y\n")
+        started = time.monotonic()
+        assert watcher.poll(5) == {str(log)}
+        assert time.monotonic() - started < 1
+    finally:
+        watcher.close()